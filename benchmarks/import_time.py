@@ -0,0 +1,97 @@
+"""Measure the cold import time of the app with `python -X importtime`.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py --output benchmarks/results/import_time.json
+    python benchmarks/import_time.py --baseline benchmarks/results/import_time.json
+
+Each repeat runs in a fresh interpreter so nothing is cached between runs.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+# Function to import the module in a fresh interpreter, returns its cumulative import time
+# and the cumulative time of each of its direct imports, in us
+def measure_once(module):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_PATH, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    total = 0
+    children = {}
+    pending = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        # Nested imports are indented by two spaces per level and printed before their parent
+        depth = (len(match.group(3)) - 1) // 2
+        name, cumulative = match.group(4), int(match.group(2))
+        if depth == 1:
+            pending[name] = pending.get(name, 0) + cumulative
+        elif depth == 0:
+            if name == module:
+                total = cumulative
+                children = pending
+            pending = {}
+    return total, children
+
+
+# Function to repeat the measure and keep the median of the total and of each direct import
+def measure(module, repeat):
+    runs = [measure_once(module) for _ in range(repeat)]
+    names = set().union(*(children for _, children in runs))
+    modules = {name: statistics.median(children.get(name, 0) for _, children in runs) for name in names}
+    return {
+        "module": module,
+        "repeat": repeat,
+        "total_ms": statistics.median(total for total, _ in runs) / 1000,
+        "modules_ms": {name: value / 1000 for name, value in sorted(modules.items(), key=lambda item: -item[1])},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="crudbot")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to print")
+    parser.add_argument("--output", help="write the result as JSON to this path")
+    parser.add_argument("--baseline", help="compare with a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    result = measure(args.module, args.repeat)
+    print(f"import {result['module']}: {result['total_ms']:.1f} ms (median of {result['repeat']})")
+    for name, value in list(result["modules_ms"].items())[:args.top]:
+        print(f"  {value:10.1f} ms  {name}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        change = result["total_ms"] / baseline["total_ms"] - 1
+        print(f"Baseline {baseline['total_ms']:.1f} ms, change {change:+.1%}")
+        if change > args.tolerance:
+            print("Import time regression")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Benchmark the CRUD, extraction and anomaly hot paths on synthetic data.
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py --rows 10k,100k --output benchmarks/results/baseline.json
+    python benchmarks/run_benchmarks.py --rows 10k,100k --baseline benchmarks/results/baseline.json
+
+Cases:
+    fetch_data       data_handler_v1.fetch_data_to_dataframe on an in-memory SQLite copy of the sheets
+    clean_data       data_handler_v1.clean_data on the fetched tables
+    crud_add         crudbot.handle_instruction "add a record where ..."
+    crud_update      crudbot.handle_instruction "update ... to ... where ..."
+    crud_delete      crudbot.handle_instruction "delete records where ..."
+    anomaly_execute  anomaly_checkerV3.execute with the email stubbed
+
+Every case reports the median time of --repeat runs, the throughput in rows per
+second and the peak memory traced by tracemalloc during one extra run.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_data
+from utils import data_handler_v1
+
+CASES = ["fetch_data", "clean_data", "crud_add", "crud_update", "crud_delete", "anomaly_execute"]
+
+
+# Function to time func(*setup()) and trace its peak memory in one extra run
+def run_case(name, rows, setup, func, repeat, measure_memory=True):
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if measure_memory:
+        args = setup()
+        tracemalloc.start()
+        func(*args)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    median = statistics.median(times)
+    result = {
+        "case": name,
+        "rows": rows,
+        "median_s": median,
+        "min_s": min(times),
+        "rows_per_s": rows / median if median else None,
+        "peak_mb": peak_mb,
+    }
+    peak = f", peak {peak_mb:.1f} MB" if peak_mb is not None else ""
+    print(f"{name:<16} {rows:>10} rows  {median:8.3f}s  {result['rows_per_s']:>12,.0f} rows/s{peak}")
+    return result
+
+
+# Function to run the selected cases on sheets of n rows, inside a scratch workspace
+def run_size(n, cases, repeat, measure_memory, workspace_path):
+    results = []
+    sheets = synthetic_data.generate_sheets(n)
+    total_rows = sum(len(df) for df in sheets.values())
+
+    # Extraction: the sheets stand in for the rep schema of the Postgres database
+    conn = sqlite3.connect(":memory:")
+    for sheet, df in sheets.items():
+        df.to_sql(sheet, conn, index=False, chunksize=10000)
+    query_dict = {sheet: f"SELECT * FROM {sheet}" for sheet in sheets}
+
+    if "fetch_data" in cases:
+        results.append(run_case("fetch_data", total_rows, lambda: (conn, query_dict),
+                                data_handler_v1.fetch_data_to_dataframe, repeat, measure_memory))
+    df_list = data_handler_v1.fetch_data_to_dataframe(conn, query_dict)
+    conn.close()
+    if "clean_data" in cases:
+        results.append(run_case("clean_data", total_rows, lambda: (df_list[::-1],),
+                                data_handler_v1.clean_data, repeat, measure_memory))
+
+    # Modules resolving their folders from the cwd at import time write to the workspace instead,
+    # the CRUD saves must not add versions to the real dataset history nor mail to the real outbox
+    from utils import dataset_versions, notifier
+    dataset_versions.VERSIONS_FOLDER_PATH = f"{workspace_path}/files/sheets/.versions"
+    notifier.SPOOL_FOLDER_PATH = f"{workspace_path}/files/outbox"
+
+    crud_cases = [case for case in cases if case.startswith("crud_")]
+    if crud_cases:
+        import crudbot
+        from streamlit import logger as streamlit_logger
+
+        # handle_instruction reports through Streamlit, which only warns when no app is running
+        streamlit_logger.set_log_level("error")
+
+        combined_df = data_handler_v1.clean_data(df_list[::-1])
+        file_path = f"{workspace_path}/combined_data.csv"
+        code = combined_df["codeagent"].dropna().iloc[0]
+        instructions = {
+            "crud_add": "add a record where nom is bench, prenom is test",
+            "crud_update": f"update nom to renamed where codeagent is {code}",
+            "crud_delete": f"delete records where codeagent is {code}",
+        }
+        for case in crud_cases:
+            results.append(run_case(
+                case, len(combined_df),
+                lambda case=case: (instructions[case], combined_df.copy(), file_path),
+                crudbot.handle_instruction, repeat, measure_memory,
+            ))
+
+    if "anomaly_execute" in cases:
+        from utils import anomaly_checkerV3, anomaly_history
+
+        synthetic_data.write_sheets(sheets, f"{workspace_path}/files/sheets")
+        os.environ.setdefault("RECEIVER_EMAIL", "benchmark@example.com")
+        anomaly_checkerV3.send_email = lambda report, recipient_email, attachment_paths=(): None
+        anomaly_history.HISTORY_FOLDER_PATH = f"{workspace_path}/files/anomalies/history"
+        current_wd = os.getcwd()
+        os.chdir(workspace_path)
+        try:
+            results.append(run_case("anomaly_execute", total_rows, lambda: (),
+                                    anomaly_checkerV3.execute, repeat, measure_memory))
+        finally:
+            os.chdir(current_wd)
+
+    return results
+
+
+# Function to compare the results with a baseline, returns the cases slower than the tolerance
+def find_regressions(results, baseline, tolerance):
+    baseline_times = {(result["case"], result["rows"]): result["median_s"] for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline_times.get((result["case"], result["rows"]))
+        if previous:
+            change = result["median_s"] / previous - 1
+            print(f"{result['case']:<16} {result['rows']:>10} rows  {previous:8.3f}s -> {result['median_s']:8.3f}s  {change:+.1%}")
+            if change > tolerance:
+                regressions.append((result["case"], result["rows"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10k", help="comma separated rows per sheet, e.g. 10k,100k,1M,10M")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated cases to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--baseline", help="compare with a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    cases = [case.strip() for case in args.cases.split(",") if case.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="sheetbot-bench-") as workspace_path:
+        for rows in args.rows.split(","):
+            results.extend(run_size(synthetic_data.parse_rows(rows), cases, args.repeat, not args.no_memory, workspace_path))
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump({"python": sys.version.split()[0], "results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions: " + ", ".join(f"{case} @ {rows} rows ({change:+.1%})" for case, rows, change in regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Generate synthetic agent, vehicule and intervention sheets of any size.
+
+The rows are resampled from the sheets in files/sheets, so the columns and value
+distributions match the real schema, then the primary keys are renumbered and the
+agent foreign keys are redrawn from the generated agents.
+
+    python benchmarks/synthetic_data.py --rows 1M --output /tmp/sheets
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHEET_FOLDER_PATH = f"{REPO_PATH}/files/sheets"
+
+# Primary key of each sheet and the prefix of its codes
+PRIMARY_KEYS = {
+    "agent": ("codeagent", "agent"),
+    "vehicule": ("codevehicule", "vehic"),
+    "intervention": ("codeintervention", "intrv"),
+}
+
+# Agent foreign keys of each sheet
+AGENT_FOREIGN_KEYS = {
+    "vehicule": ["agentchauffeur"],
+    "intervention": ["agentresponsable", "agentoperationnel", "agentreparation"],
+}
+
+
+# Function to parse sizes such as 10k, 2.5M or 10000
+def parse_rows(value):
+    value = str(value).strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1], 1)
+    if value[-1] in "km":
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+# Function to build n codes such as agent000000000000042
+def make_codes(prefix, n, start=0):
+    return prefix + pd.Series(np.arange(start, start + n)).astype(str).str.zfill(15)
+
+
+# Function to generate one sheet of n rows, agent_codes feeds its agent foreign keys
+def generate_sheet(sheet, n, rng, agent_codes=None, orphan_rate=0.0):
+    template = pd.read_csv(f"{SHEET_FOLDER_PATH}/{sheet}.csv")
+    df = template.iloc[rng.integers(0, len(template), n)].reset_index(drop=True)
+
+    key_column, prefix = PRIMARY_KEYS[sheet]
+    df[key_column] = make_codes(prefix, n)
+
+    if agent_codes is not None:
+        for column in AGENT_FOREIGN_KEYS.get(sheet, []):
+            # Keep the empty references of the template, redraw the others
+            filled = df[column].notna().to_numpy()
+            codes = agent_codes[rng.integers(0, len(agent_codes), n)]
+            orphans = rng.random(n) < orphan_rate
+            codes = np.where(orphans, "agent_unknown", codes)
+            df[column] = np.where(filled, codes, None)
+    return df
+
+
+# Function to generate all the sheets with n rows each
+def generate_sheets(n, seed=42, orphan_rate=0.001):
+    rng = np.random.default_rng(seed)
+    agent_df = generate_sheet("agent", n, rng)
+    agent_codes = agent_df["codeagent"].to_numpy()
+    return {
+        "agent": agent_df,
+        "vehicule": generate_sheet("vehicule", n, rng, agent_codes, orphan_rate),
+        "intervention": generate_sheet("intervention", n, rng, agent_codes, orphan_rate),
+    }
+
+
+# Function to write the generated sheets as CSV files, the layout of files/sheets
+def write_sheets(sheets, folder_path):
+    os.makedirs(folder_path, exist_ok=True)
+    for sheet, df in sheets.items():
+        df.to_csv(f"{folder_path}/{sheet}.csv", index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10k", help="rows per sheet, e.g. 10k, 1M")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--orphan-rate", type=float, default=0.001, help="share of foreign keys pointing to unknown agents")
+    parser.add_argument("--output", required=True, help="folder receiving agent.csv, vehicule.csv and intervention.csv")
+    args = parser.parse_args()
+
+    sheets = generate_sheets(parse_rows(args.rows), args.seed, args.orphan_rate)
+    write_sheets(sheets, args.output)
+    print(f"Wrote {', '.join(f'{sheet} ({len(df)} rows)' for sheet, df in sheets.items())} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
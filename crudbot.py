@@ -2,22 +2,22 @@ import pandas as pd
 import streamlit as st
 import re
 import os
-import tempfile
 import threading
-from utils.run_anomaly import scheduler_execute
 from utils import data_handler_v1
-import openai
+from utils import chat_history
+from utils import query_runner
+from utils import language_router
+from utils import tracing
+from utils import agent_context
+from utils import dataset_versions
+from utils.result_view import ResultView
 from dotenv import load_dotenv
-from langchain_experimental.agents.agent_toolkits import create_csv_agent
-from langchain_openai import ChatOpenAI
-from langdetect import detect
 
+# The LLM, anomaly and scheduling modules are heavy, they are imported on first use
+# to keep the startup and every Streamlit rerun fast (see benchmarks/import_time.py)
 
 load_dotenv()
 
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY") 
-
 # df = pd.read_csv('combined_data.csv')
 
 # Function to load a CSV file into a DataFrame
@@ -29,20 +29,30 @@ def load_csv(file_path):
         st.error(f"Error loading CSV file: {e}")
         return None
 
+# Function to show a status message, a query running in the background has no Streamlit
+# context so its messages are kept on the job and shown by render_active_query
+def show_status(level, message):
+    job = query_runner.current_job()
+    if job is not None:
+        job.add_notice(level, message)
+    else:
+        getattr(st, level)(message)
+
 # Function to save the DataFrame to a CSV file
+# Every save is recorded as a version of the dataset so it can be rolled back
 def save_csv(df, file_path, trigger):
     try:
-        df.to_csv(file_path, index=False)
+        dataset_versions.save(df, file_path, trigger)
         if trigger == "update":
-            st.success("File updated successfully.")
+            show_status("success", "File updated successfully.")
         elif trigger == "add":
-            st.success("Record(s) added successfully.")
+            show_status("success", "Record(s) added successfully.")
         elif trigger == "delete":
-            st.success("Records deleted successfully.")
+            show_status("success", "Records deleted successfully.")
         else:
-            st.success("Changes made to File were successful")
+            show_status("success", "Changes made to File were successful")
     except Exception as e:
-        st.error(f"Error saving CSV file: {e}")
+        show_status("error", f"Error saving CSV file: {e}")
 
 # Function to add a record
 def add_record(new_data, df, file_path):
@@ -63,9 +73,9 @@ def add_record(new_data, df, file_path):
         df = pd.concat([df, new_row], ignore_index=True)
 
         # Save back to the file
-        df.to_csv(file_path, index=False)
+        dataset_versions.save(df, file_path, "add")
         # return "Record added successfully."
-        return new_row
+        return ResultView(new_row, new_row.index)
     except Exception as e:
         return f"Error adding record: {e}"
 
@@ -78,9 +88,9 @@ def update_record(condition, update_values, df, file_path):
             df.loc[condition, col] = value
         save_csv(df, file_path, "update")
         # return "Records updated successfully."
-        return df
+        return ResultView(df, df.index[pd.Series(condition, index=df.index).to_numpy(dtype=bool)])
     except Exception as e:
-        st.error(f"Error updating records: {e}")
+        show_status("error", f"Error updating records: {e}")
         return "Error updating records."
 
 # Function to delete records based on a condition
@@ -91,43 +101,53 @@ def delete_record(condition, df, file_path):
         save_csv(df, file_path, "delete")
         return "Deleted Successfully"
     except Exception as e:
-        st.error(f"Error deleting records: {e}")
+        show_status("error", f"Error deleting records: {e}")
         return "Error deleting records."
 
 
-# Function to handle various user queries
-def handle_instruction(instruction_org, df, file_path):
+# Instruction keywords per language, handle_instruction accepts both and get_language routes on them first
+DATE_KEYWORDS = {
+    "after": {"en": ["after"], "fr": ["après"]},
+    "before": {"en": ["before"], "fr": ["avant"]},
+    "on": {"en": ["on"], "fr": ["le"]},
+}
+
+KEYWORDS = {
+    "add": {"en": ["add"], "fr": ["ajouter"]},
+    "update": {"en": ["update", "edit", "set"], "fr": ["modifier", "mettre"]},
+    "delete": {"en": ["delete", "remove"], "fr": ["supprimer", "retirer"]},
+    "find": {"en": ["find"], "fr": ["trouver", "rechercher", "chercher", "cherche"]},
+    "where": {"en": ["where"], "fr": ["où", "ou"]},
+    "is": {"en": ["is"], "fr": ["est"]},
+    "greater than": {"en": ["greater than"], "fr": ["supérieur à", "plus que"]},
+    "less than": {"en": ["less than"], "fr": ["inférieur à", "moins que"]},
+    "equals": {"en": ["equals"], "fr": ["égal à"]},
+    "contains": {"en": ["contains"], "fr": ["contient", "à"]},
+    "of": {"en": ["of"], "fr": ["de"]},
+    "before": {"en": ["before"], "fr": ["avant"]},
+    "after": {"en": ["after"], "fr": ["après"]},
+    "history": {"en": ["history"], "fr": ["historique"]},
+}
+
+# Function to handle various user queries, each call is traced for the debug panel
+# callbacks are LangChain callback handlers, they receive the streamed tokens and steps of the LLM agent
+def handle_instruction(instruction_org, df, file_path, callbacks=None):
+    with tracing.span("handle_instruction", rows=len(df)):
+        return process_instruction(instruction_org, df, file_path, callbacks)
+
+def process_instruction(instruction_org, df, file_path, callbacks=None):
     try:
 
-        date_keywords = {
-            "after": ["after", "après"],
-            "before": ["before", "avant"],
-            "on": ["on", "le"],
-        }
-
-        keywords = {
-            "add": ["add", "ajouter"],
-            "update": ["update", "edit", "set", "modifier", "mettre"],
-            "delete": ["delete", "remove", "supprimer", "retirer"],
-            "find": ["find", "trouver", "rechercher", "chercher", "cherche"],
-            "where": ["where", "où", "ou"],
-            "is": ["is", "est"],
-            "greater than": ["greater than", "supérieur à", "plus que"],
-            "less than": ["less than", "inférieur à", "moins que"],
-            "equals": ["equals", "égal à"],
-            "contains": ["contains", "contient", "à"],
-            "is": ["is", "est"],
-            "of": ["of", "de"],
-            "before": ["before", "avant"],
-            "after": ["after", "après"]
-        }
+        date_keywords = {key: words["en"] + words["fr"] for key, words in DATE_KEYWORDS.items()}
+        keywords = {key: words["en"] + words["fr"] for key, words in KEYWORDS.items()}
         instruction = instruction_org.lower()
         # Handle "add" queries
         # if "add" in instruction.lower():
-        print("Step 1")
         if any(instruction.startswith(keyword) for keyword in keywords["add"]):
+            tracing.annotate(route="add")
             # Assuming a simple format: "Add a record where column1 is value1, column2 is value2, ..."
             # pattern = re.findall(r"(\w+)\s*is\s*([\w\s]+)", instruction, re.IGNORECASE)
+            parse_span = tracing.start_span("parse")
             pattern = re.findall(r"(\w+)\s*(?:is|est)\s*([\w\s]+)", instruction, re.IGNORECASE)
             if not pattern:
                 return "Could not parse the addition instruction. Please follow the format: 'Add a record where column1 is value1, column2 is value2, ...'"
@@ -139,9 +159,10 @@ def handle_instruction(instruction_org, df, file_path):
 
             if not new_data:
                 return "No valid columns found for the new record."
+            parse_span.end()
             print(new_data)
             result = add_record(new_data, df, file_path)
-            st.success("Record Added successfully.")
+            show_status("success", "Record Added successfully.")
             return result
 
         # Handle "update" queries
@@ -152,8 +173,9 @@ def handle_instruction(instruction_org, df, file_path):
         #         instruction,
         #         re.IGNORECASE,
         #     )
-        print("Step 2")
         if any(instruction.startswith(keyword) for keyword in keywords["update"]):
+            tracing.annotate(route="update")
+            parse_span = tracing.start_span("parse")
             condition_match = re.search(
                 r"(?:update|modifier)\s+(\w+)\s+(?:to|à)\s+([\w\s\d.]+)\s+(?:where|où)\s+(.+)",
                 # r"(update|modifier)\s+(\w+)\s+(to|à)\s+([\w\s\d.]+)\s+(where|où)\s+(.+)",
@@ -169,8 +191,10 @@ def handle_instruction(instruction_org, df, file_path):
             # Ensure column exists
             if column_to_update not in df.columns:
                 return f"Column '{column_to_update}' not found in the DataFrame."
+            parse_span.end()
 
             # Split conditions by "or"
+            mask_span = tracing.start_span("mask")
             or_conditions = [cond.strip() for cond in condition.split(" or ")]
 
             # Initialize the complete query
@@ -220,6 +244,7 @@ def handle_instruction(instruction_org, df, file_path):
 
             if complete_query is None:
                 return "Could not construct the condition. Please check your syntax."
+            mask_span.end(rows=int(complete_query.sum()))
 
             # Ensure new_value is compatible with the target column
             if pd.api.types.is_numeric_dtype(df[column_to_update]):
@@ -231,10 +256,11 @@ def handle_instruction(instruction_org, df, file_path):
             df.loc[complete_query, column_to_update] = new_value
 
             # Save the updated DataFrame to the file
-            df.to_csv(file_path, index=False)
+            dataset_versions.save(df, file_path, "update")
             # return f"Records updated successfully in column '{column_to_update}'."
-            st.success("File updated successfully.")
-            return df
+            show_status("success", "File updated successfully.")
+            # Only the updated rows are returned, as a lazy view of the frame
+            return ResultView(df, df.index[complete_query.to_numpy()])
 
         # Handle "delete" queries
         # if (("delete" in instruction.lower())) or ("remove" in instruction.lower()):
@@ -246,8 +272,9 @@ def handle_instruction(instruction_org, df, file_path):
         #         instruction,
         #         re.IGNORECASE,
         #     )
-        print("Step 3")
         if any(instruction.startswith(keyword) for keyword in keywords["delete"]):
+            tracing.annotate(route="delete")
+            parse_span = tracing.start_span("parse")
             condition_match = re.search(
                 # r"(\w+)\s+(?:greater than|supérieur à|plus que|moin que|less than|inférieur à|equals|égal à|is|est|contains|contient|à)\s+([\w\s\d.]+)",
                 r"(\w+)\s+(greater than|supérieur à|plus que|moin que|less than|inférieur à|equals|égal à|is|est|contains|contient|à)\s+([\w\s\d.]+)",
@@ -263,8 +290,10 @@ def handle_instruction(instruction_org, df, file_path):
             # Ensure column exists
             if col not in df.columns:
                 return f"Column '{col}' not found in the DataFrame."
+            parse_span.end()
 
             # Identify column data type and condition
+            mask_span = tracing.start_span("mask")
             if operator in ["greater than", "supérieur à", "plus que", "less than", "inférieur à", "moins que", "equals", "equals", "égal à"]:
                 # Check if column can be coerced to numeric
                 if pd.api.types.is_numeric_dtype(df[col]) or df[col].apply(lambda x: str(x).replace('.', '', 1).isdigit()).all():
@@ -292,50 +321,79 @@ def handle_instruction(instruction_org, df, file_path):
             else:
                 return "Unsupported operator. Use 'greater than', 'less than', 'equals', or 'contains'."
 
+            mask_span.end(rows=int(condition.sum()))
+
             # Perform deletion
             result = delete_record(condition, df, file_path)
 
             return result
 
 
+        # Handle "history" queries, e.g. "history this month per vehicle" or "history of <code>"
+        if any(instruction.startswith(keyword) for keyword in keywords["history"]):
+            tracing.annotate(route="history")
+            from utils import anomaly_history
+            return anomaly_history.history_query(instruction)
+
         # Handle "how many" queries and other operations...
         # (Add the existing code from your previous `handle_instruction` function here.)
 
-        print("Step 4")
-
-        llm = ChatOpenAI(temperature=0.5, model="gpt-4o-mini")
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False) as temp_csv:
-            df.to_csv(temp_csv.name, index=False)
-            temp_csv_path = temp_csv.name  
-
-        agent_executer = create_csv_agent(
-            llm, temp_csv_path, verbose=True, 
+        tracing.annotate(route="llm_agent")
+        import openai
+        from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+        from langchain_openai import ChatOpenAI
+
+        # Set your OpenAI API key
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        llm = ChatOpenAI(temperature=0.5, model="gpt-4o-mini", streaming=callbacks is not None)
+        # The agent gets a pruned, typed copy of the relevant rows and columns and their
+        # precomputed schema and statistics, instead of the whole table dumped to a CSV
+        context_df, prefix = agent_context.prepare_context(instruction_org, df)
+
+        agent_executer = create_pandas_dataframe_agent(
+            llm, context_df, verbose=True,
+            prefix=prefix,
             allow_dangerous_code=True,
-            handle_parsing_errors=True,
-            max_iterations=10, 
-            max_execution_time=30 
+            agent_executor_kwargs={"handle_parsing_errors": True},
+            max_iterations=10,
+            max_execution_time=30
     )
-        response = agent_executer.invoke(instruction_org)
+        with tracing.span("llm_agent"):
+            response = agent_executer.invoke(instruction_org, config={"callbacks": callbacks})
         print(response)
-        os.remove(temp_csv_path)
         return response["output"]
 
+    except query_runner.QueryCancelled:
+        # A cancel is not an error, start_query reports it
+        raise
     except Exception as e:
-        st.error(f"Error handling instruction: {e}")
+        show_status("error", f"Error handling instruction: {e}")
         return f"Error handling instruction: {e}"
 
+# Cached so the scheduler is set up once per process and not on every Streamlit rerun
+@st.cache_resource
 def start_periodic_task():
     """Starts the anomaly check task in a separate thread."""
-    periodic_thread = threading.Thread(target=scheduler_execute)
+    from utils import run_anomaly
+    run_anomaly.register_jobs()
+    periodic_thread = threading.Thread(target=run_anomaly.scheduler_execute)
     periodic_thread.daemon = True  # Ensures the thread exits when the main program exits
     periodic_thread.start()
     print(f"Background task started")
+    return periodic_thread
+
+
+# Cached so the /metrics endpoint (METRICS_PORT) is started once per process
+@st.cache_resource
+def start_metrics_exporter():
+    return tracing.start_metrics_server()
 
 
-# Detect the language of the input
+# Detect the language of the input, keyword matches and the session cache avoid running langdetect
 def get_language(input_text):
     try:
-        return detect(input_text)  
+        cache = st.session_state.setdefault("language_cache", {})
+        return language_router.detect_language(input_text, [KEYWORDS, DATE_KEYWORDS], cache)
     except:
         return None  
 
@@ -438,7 +496,11 @@ def main():
     # Sidebar for file selection
     current_wd = os.getcwd()
     sheet_folder_path = f"{current_wd}/files/sheets"
+    file_path = f'{sheet_folder_path}/combined_data.csv'
     
+    # The query in progress works on the session frame, it is not replaced until the query is over
+    query_running = st.session_state.get("active_query") is not None
+
     # Sidebar for database connection
     st.sidebar.header("Database Connection Details")
     with st.sidebar.form("db_connection_form"):
@@ -447,28 +509,61 @@ def main():
         db_name = st.text_input("Database Name", placeholder="e.g., mydb")
         db_user = st.text_input("Username", placeholder="e.g., admin")
         db_password = st.text_input("Password", type="password")
-        db_submit = st.form_submit_button("Connect")
+        db_submit = st.form_submit_button("Connect", disabled=query_running)
 
     if db_submit:
         try:
             
             cleaned_df = data_handler_v1.main(db_user, db_password, db_host, db_port, db_name)
-            st.session_state["cleaned_df"] = cleaned_df
+            set_session_df(cleaned_df)
+            # The loaded data is versioned before any change, an accidental delete can be rolled back to it
+            dataset_versions.record(cleaned_df, file_path, "connect")
             # Feedback for successful connection
             st.sidebar.success("Connected successfully!")
         except Exception as e:
             st.sidebar.error(f"Connection failed: {str(e)}")
 
-    file_path = f'{sheet_folder_path}/combined_data.csv'
-
-    # Initialize chat history
-    if "messages" not in st.session_state:
-        st.session_state["messages"] = []
+    # Debug panel with the timing breakdown of the last requests
+    if st.sidebar.checkbox("Show request timings"):
+        for request in tracing.recent_requests():
+            route = request.attrs.get("route", "")
+            with st.sidebar.expander(f"{request.name} {route} - {(request.duration or 0) * 1000:.0f} ms"):
+                st.dataframe(pd.DataFrame(tracing.breakdown(request)), hide_index=True, use_container_width=True)
+
+    # Versions of the dataset recorded by every save, restoring one also reloads the data of the session
+    with st.sidebar.expander("Dataset versions"):
+        versions = dataset_versions.list_versions(file_path)[::-1]
+        if not versions:
+            st.write("No versions recorded yet.")
+        else:
+            labels = {version["id"]: f"{version['created_at']} - {version['trigger']} ({version['rows']} rows)" for version in versions}
+            version_id = st.selectbox("Version", list(labels), format_func=labels.get)
+            if query_running:
+                st.caption("Available once the current query is over.")
+            if st.button("Restore this version", disabled=query_running):
+                try:
+                    set_session_df(dataset_versions.rollback(file_path, version_id))
+                    st.success("Version restored.")
+                except Exception as e:
+                    st.error(f"Error restoring version: {e}")
+
+    # Initialize chat history, result frames are paged and spilled to disk past the memory cap
+    if "chat_history" not in st.session_state:
+        st.session_state["chat_history"] = chat_history.ChatHistory()
+    history = st.session_state["chat_history"]
+    # Clearing also deletes the result frames spilled to disk
+    if st.sidebar.button("Clear chat history", disabled=query_running):
+        history.clear()
+        st.rerun()
 
     # Display chat history
     with st.container(border=True):
         st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-        for msg in st.session_state["messages"]:
+        if history.hidden_count():
+            if st.button(f"Show older messages ({history.hidden_count()} hidden)"):
+                history.show_older()
+                st.rerun()
+        for msg in history.visible_messages():
             if msg["type"] == "text":
                 sender_class = "bot-message" if msg["sender"] == "bot" else "user-message"
                 st.markdown(
@@ -477,22 +572,36 @@ def main():
                 )
             elif msg["type"] == "dataframe":
                 st.write("### Response:")
-                st.dataframe(msg["content"], use_container_width=True)
+                page_count = history.store.page_count(msg["frame_id"])
+                page = 0
+                if page_count > 1:
+                    page = st.number_input(
+                        f"Page (of {page_count}, {msg['rows']} rows)", min_value=1, max_value=page_count,
+                        value=1, key=f"page_{msg['frame_id']}"
+                    ) - 1
+                st.dataframe(history.store.get_page(msg["frame_id"], page), use_container_width=True)
         st.markdown("<br><br>", unsafe_allow_html=True)
         st.markdown("</div>", unsafe_allow_html=True)
 
+    # Streamed output of the query in progress
+    render_active_query()
+
     # Input box at the bottom
     with st.form("chat_input_form", clear_on_submit=True):
         user_input = st.text_input("Type your query:", "", key="chat_input", label_visibility="hidden", placeholder="Type your query")
         submitted = st.form_submit_button("Send")
     # Handle user input and bot response
     if submitted and user_input.strip():
+        if st.session_state.get("active_query") is not None:
+            st.warning("Please wait for the current query to finish or cancel it.")
+            return
+
         # Add user message to chat history
-        st.session_state["messages"].append({"sender": "user", "type": "text", "content": user_input})
+        history.add_text("user", user_input)
 
         if "cleaned_df" not in st.session_state:
             bot_response = "Data can't be accessed"
-            st.session_state["messages"].append({"sender": "bot", "type": "text", "content": bot_response})
+            history.add_text("bot", bot_response)
         else:
             cleaned_df = st.session_state["cleaned_df"]
             # Call query handling logic
@@ -504,16 +613,59 @@ def main():
             else:
                 instructional_prompt = "If you're doing a search then it should not be case sensitive, your output should not be a process of what should be done but rather the result. respond only in English with a phrase or sentence."
             edited_user_input = f"{user_input}. {instructional_prompt}"
-            result = handle_instruction(edited_user_input, cleaned_df, file_path)
-            if isinstance(result, pd.DataFrame):
-                st.session_state["messages"].append({"sender": "bot", "type": "dataframe", "content": result})
-            else:
-                st.session_state["messages"].append({"sender": "bot", "type": "text", "content": result})
+            # Run the query off the script thread, render_active_query streams its output
+            st.session_state["active_query"] = query_runner.start_query(handle_instruction, edited_user_input, cleaned_df, file_path)
 
         # Refresh to display the new message
         st.rerun()
 
 
+# Replace the data of the session, results still viewing the old frame keep a copy of their rows only
+def set_session_df(df):
+    st.session_state["cleaned_df"] = df
+    if "chat_history" in st.session_state:
+        st.session_state["chat_history"].store.detach_views(df)
+
+
+# Add the bot response to the chat history
+def add_bot_response(history, result):
+    if isinstance(result, (pd.DataFrame, ResultView)):
+        history.add_dataframe("bot", result)
+    else:
+        history.add_text("bot", result)
+
+
+# Polls the query in progress, shows its streamed tokens and steps and lets the user cancel it
+@st.fragment(run_every=0.5)
+def render_active_query():
+    job = st.session_state.get("active_query")
+    if job is None:
+        return
+
+    if job.done():
+        st.session_state["active_query"] = None
+        history = st.session_state["chat_history"]
+        for level, message in job.get_notices():
+            history.add_text("bot", message)
+        add_bot_response(history, job.result)
+        st.rerun()
+
+    text, steps = job.progress()
+    with st.container(border=True):
+        st.caption(f"Working on it... {job.elapsed():.0f}s")
+        for level, message in job.get_notices():
+            getattr(st, level)(message)
+        for step in steps:
+            st.code(step)
+        if text:
+            st.markdown(f'<div class="chat-message bot-message">{text}</div>', unsafe_allow_html=True)
+        if job.cancelled():
+            st.caption("Cancelling...")
+        elif st.button("Cancel", key="cancel_query"):
+            job.cancel()
+
+
 if __name__ == "__main__":
     start_periodic_task()
+    start_metrics_exporter()
     main()
@@ -0,0 +1,148 @@
+import re
+import os
+import pandas as pd
+from dotenv import load_dotenv
+from utils import tracing
+
+load_dotenv()
+
+# Words pointing to a source_table in English and French, besides the table name itself
+TABLE_KEYWORDS = {
+    "agent": ["agent", "agents", "employee", "employees", "employé", "employés", "driver", "drivers", "chauffeur", "chauffeurs", "staff", "personnel"],
+    "vehicule": ["vehicle", "vehicles", "véhicule", "véhicules", "vehicule", "vehicules", "car", "cars", "voiture", "voitures", "truck", "camion", "camions"],
+    "intervention": ["intervention", "interventions", "repair", "repairs", "réparation", "réparations", "panne", "pannes", "breakdown", "breakdowns"],
+}
+
+# Columns never sent to the agent: duplicated text and binary or file references
+EXCLUDED_COLUMNS = re.compile(r"^(searchable_text|unnamed: \d+|photo|image.*|fichier\d+|cv|piecejointe|record|rfid|smartfinger|qrcode|card|ord)$", re.IGNORECASE)
+# Above this many columns in one table, the ones named in the question and the descriptive ones are kept first
+AGENT_MAX_COLUMNS = int(os.getenv("AGENT_MAX_COLUMNS", "40"))
+# Descriptive columns kept even when the question does not name them
+KEY_COLUMNS = ["source_table", "filename", "codeagent", "nom", "prenom", "matricule", "codevehicule", "immat", "fabricant", "codeintervention", "lieu", "probleme", "etat", "statut"]
+
+AGENT_PREFIX = """You are working with a pandas dataframe in Python. The name of the dataframe is `df`.
+It only holds the rows and columns relevant to the question, taken from the {tables} table(s); columns empty for these tables were removed.{dropped}
+The schema and statistics below are already computed, use them to answer directly when they are enough instead of exploring the dataframe:
+{summary}
+You should use the tools below to answer the question posed of you:"""
+
+
+# Function to label each row with its table, source_table from the database or the sheet file name
+def table_labels(df):
+    if "source_table" in df.columns:
+        return df["source_table"]
+    if "filename" in df.columns:
+        return df["filename"].str.replace(r"^updated_|\.csv$", "", regex=True)
+    return None
+
+
+# Function to find the source tables the question is about, all of them when none is named
+def select_tables(question, labels):
+    if labels is None:
+        return []
+    tables = [table for table in labels.dropna().unique()]
+    words = set(re.findall(r"\w+", question.lower()))
+
+    selected = []
+    for table in tables:
+        names = {table.lower(), table.lower().rstrip("s")} | set(TABLE_KEYWORDS.get(table.lower(), []))
+        if names & words:
+            selected.append(table)
+    return selected or tables
+
+
+# Function to keep the columns filled for one table, capped with the ones named in the question first
+def table_columns(question, rows):
+    filled = rows.notna().any()
+    columns = [col for col in rows.columns if filled[col] and not EXCLUDED_COLUMNS.match(col)]
+    if len(columns) <= AGENT_MAX_COLUMNS:
+        return columns, []
+
+    words = set(re.findall(r"\w+", question.lower()))
+    named = [col for col in columns if col.lower() in words]
+    descriptive = [col for col in KEY_COLUMNS if col in columns and col not in named]
+    others = [col for col in columns if col not in named and col not in descriptive]
+    ordered = named + descriptive + others
+    return ordered[:AGENT_MAX_COLUMNS], ordered[AGENT_MAX_COLUMNS:]
+
+
+# Function to select the columns of the selected tables, the cap applies to each table so a
+# question naming no table still gets the columns of every table; returns the kept and dropped columns
+def select_columns(question, df, labels, tables):
+    if not tables:
+        return table_columns(question, df)
+
+    kept = set()
+    dropped = set()
+    for table in tables:
+        table_kept, table_dropped = table_columns(question, df[labels == table])
+        kept.update(table_kept)
+        dropped.update(table_dropped)
+    columns = [col for col in df.columns if col in kept]
+    return columns, [col for col in df.columns if col in dropped and col not in kept]
+
+
+# Function to give the columns their real types, dates and numbers are stored as text in combined_data
+def to_typed_frame(df):
+    df = df.copy()
+    for col in df.select_dtypes("object").columns:
+        values = df[col].dropna()
+        if values.empty:
+            continue
+        if col.startswith("date"):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+            continue
+        numbers = pd.to_numeric(values, errors="coerce")
+        if numbers.notna().all():
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+# Function to describe each column in one line: type, filled rows, distinct values and a summary
+def summarize(df):
+    lines = [f"{len(df)} rows"]
+    labels = table_labels(df)
+    if labels is not None:
+        counts = labels.value_counts()
+        lines.append("rows per table: " + ", ".join(f"{table}={count}" for table, count in counts.items()))
+    for col in df.columns:
+        values = df[col].dropna()
+        line = f"- {col} ({df[col].dtype}): {len(values)} filled, {values.nunique()} distinct"
+        if values.empty:
+            pass
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            line += f", min {values.min():g}, max {values.max():g}, mean {values.mean():g}"
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            line += f", from {values.min().date()} to {values.max().date()}"
+        elif values.nunique() == len(values):
+            line += ", unique per row, e.g. " + ", ".join(repr(value[:40]) for value in values.astype(str).head(2))
+        else:
+            top = values.astype(str).value_counts().head(3)
+            line += ", most frequent: " + ", ".join(f"{value[:40]!r} ({count})" for value, count in top.items())
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# Function to prepare what the LLM agent gets: a pruned, typed copy of the relevant rows and
+# columns, and the prompt prefix holding its schema and statistics
+def prepare_context(question, df):
+    with tracing.span("prepare_context") as current:
+        labels = table_labels(df)
+        tables = select_tables(question, labels)
+        columns, dropped = select_columns(question, df, labels, tables)
+        rows = df[labels.isin(tables)] if tables else df
+        # The agent runs generated code, it works on its own copy and never on the session frame
+        frame = to_typed_frame(rows[columns]).reset_index(drop=True)
+        summary = summarize(frame)
+        current.set(rows=len(frame), columns=len(columns), dropped=len(dropped), tables=", ".join(map(str, tables)))
+
+    # The prefix becomes part of a prompt template, braces of the data must be escaped
+    prefix = AGENT_PREFIX.format(
+        tables=", ".join(map(str, tables)) or "combined",
+        dropped=(
+            f"\nTo keep the prompt short, only {AGENT_MAX_COLUMNS} columns per table were kept; these columns exist in the data "
+            f"but are not in `df`: {', '.join(dropped)}. If the question needs one of them, say so instead of guessing."
+        ) if dropped else "",
+        summary=summary.replace("{", "{{").replace("}", "}}"),
+    )
+    return frame, prefix
@@ -1,5 +1,4 @@
 import pandas as pd
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -7,6 +6,9 @@ from email import encoders
 import os
 import time
 from dotenv import load_dotenv
+from utils import integrity_checker
+from utils import notifier
+from utils import tracing
 
 load_dotenv()
 # Email alert function with file attachments
@@ -14,7 +16,6 @@ def send_email_alert_with_attachment(subject, body, recipient_email, attachment_
     # sender_email = os.getenv("SENDER_EMAIL")
 
     sender_email = os.environ["SENDER_EMAIL"]
-    password = os.environ["SENDER_PASS"]
 
     #Instanvi chatbot1
 
@@ -38,19 +39,16 @@ def send_email_alert_with_attachment(subject, body, recipient_email, attachment_
                 )
                 msg.attach(part)
 
-        # Send the email
-        server = smtplib.SMTP('smtp.gmail.com', 587)  # Replace with your SMTP server and port
-        server.starttls()
-        server.login(sender_email, password)
-        server.sendmail(sender_email, recipient_email, msg.as_string())
-        server.quit()
+        # Queue the email, the notifier delivers it in the background and retries on failure
+        notifier.enqueue(msg, recipient_email)
 
-        print(f"Email sent to {recipient_email}")
+        print(f"Email queued for {recipient_email}")
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        print(f"Failed to queue email: {e}")
 
 
 # Function to check anomalies in multiple CSVs
+@tracing.traced("check_anomalies")
 def check_anomalies_and_notify():
 
     
@@ -72,21 +70,21 @@ def check_anomalies_and_notify():
     missing_values_vehicule = vehicule_df[vehicule_df[important_columns_vehicule].isnull().any(axis=1)]
     if not missing_values_vehicule.empty:
         anomaly_path = 'missing_values_vehicule.csv'
-        missing_values_vehicule.to_csv(f"{files_path}/anomalies/{anomaly_path}", index=False)
+        tracing.write_csv(missing_values_vehicule, f"{files_path}/anomalies/{anomaly_path}", index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Missing values in 'vehicule.csv' (see {anomaly_path}).")
 
     duplicate_vehicles = vehicule_df[vehicule_df.duplicated(subset=['codevehicule'], keep=False)]
     if not duplicate_vehicles.empty:
         anomaly_path = 'duplicate_vehicles.csv'
-        duplicate_vehicles.to_csv(f"{files_path}/anomalies/{anomaly_path}", index=False)
+        tracing.write_csv(duplicate_vehicles, f"{files_path}/anomalies/{anomaly_path}", index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Duplicate records in 'vehicule.csv' (see {anomaly_path}).")
 
     outlier_vidange = vehicule_df[vehicule_df['vidange'] > 100000]
     if not outlier_vidange.empty:
         anomaly_path = 'outlier_vidange.csv'
-        outlier_vidange.to_csv(f"{files_path}/anomalies/{anomaly_path}", index=False)
+        tracing.write_csv(outlier_vidange, f"{files_path}/anomalies/{anomaly_path}", index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Outliers in 'vidange' column of 'vehicule.csv' (see {anomaly_path}).")
 
@@ -95,14 +93,14 @@ def check_anomalies_and_notify():
     missing_values_agent = agent_df[agent_df[important_columns_agent].isnull().any(axis=1)]
     if not missing_values_agent.empty:
         anomaly_path = 'missing_values_agent.csv'
-        missing_values_agent.to_csv(f"{files_path}/anomalies/{anomaly_path}", index=False)
+        tracing.write_csv(missing_values_agent, f"{files_path}/anomalies/{anomaly_path}", index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Missing values in 'agent.csv' (see {anomaly_path}).")
 
     duplicate_agents = agent_df[agent_df.duplicated(subset=['codeagent'], keep=False)]
     if not duplicate_agents.empty:
         anomaly_path = 'duplicate_agents.csv'
-        duplicate_agents.to_csv(f"{files_path}/anomalies/{anomaly_path}", index=False)
+        tracing.write_csv(duplicate_agents, f"{files_path}/anomalies/{anomaly_path}", index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Duplicate records in 'agent.csv' (see {anomaly_path}).")
 
@@ -111,17 +109,29 @@ def check_anomalies_and_notify():
     missing_values_intervention = intervention_df[intervention_df[important_columns_intervention].isnull().any(axis=1)]
     if not missing_values_intervention.empty:
         anomaly_path = 'missing_values_intervention.csv'
-        missing_values_intervention.to_csv(anomaly_path, index=False)
+        tracing.write_csv(missing_values_intervention, anomaly_path, index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Missing values in 'intervention.csv' (see {anomaly_path}).")
 
     duplicate_interventions = intervention_df[intervention_df.duplicated(subset=['codeintervention'], keep=False)]
     if not duplicate_interventions.empty:
         anomaly_path = 'duplicate_interventions.csv'
-        duplicate_interventions.to_csv(f"{files_path}/anomalies/{anomaly_path}", index=False)
+        tracing.write_csv(duplicate_interventions, f"{files_path}/anomalies/{anomaly_path}", index=False)
         attachments.append(f"{files_path}/anomalies/{anomaly_path}")
         summary.append(f"Duplicate records in 'intervention.csv' (see {anomaly_path}).")
 
+    # Referential integrity anomalies
+    sheets = {"agent": agent_df, "vehicule": vehicule_df, "intervention": intervention_df}
+    integrity_anomalies = integrity_checker.check_referential_integrity(sheets)
+    for sheet, references in integrity_checker.FOREIGN_KEYS.items():
+        for column in references:
+            orphaned_rows = integrity_anomalies.get(f"Orphaned {column} ({sheet}.csv)")
+            if orphaned_rows is not None and not orphaned_rows.empty:
+                anomaly_path = f'orphaned_{column}_{sheet}.csv'
+                tracing.write_csv(orphaned_rows, f"{files_path}/anomalies/{anomaly_path}", index=False)
+                attachments.append(f"{files_path}/anomalies/{anomaly_path}")
+                summary.append(f"Unknown agent codes in '{column}' of '{sheet}.csv' (see {anomaly_path}).")
+
     # Send email if anomalies detected
     if summary:
         receiver_email = os.environ["RECEIVER_EMAIL"]
@@ -1,16 +1,25 @@
 import os
 import pandas as pd
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.mime.base import MIMEBase
+from email import encoders
 from dotenv import load_dotenv
+from utils import integrity_checker
+from utils import report_builder
+from utils import notifier
+from utils import parallel_runner
+from utils import anomaly_history
+from utils import tracing
 
 load_dotenv()
 
 # Function to detect numerical anomalies
 def detect_numerical_anomalies(df, column):
+    # scikit-learn is slow to import, load it only when an analysis runs
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+
     model = IsolationForest(contamination=0.05, random_state=42)
     df['scaled'] = StandardScaler().fit_transform(df[[column]])
     df['anomaly'] = model.fit_predict(df[['scaled']])
@@ -18,7 +27,11 @@ def detect_numerical_anomalies(df, column):
 
 # Generate Agent File Anomaly Report
 def analyze_agent_file(file_path):
-    agent_df = pd.read_csv(file_path)
+    return analyze_agent_df(pd.read_csv(file_path))
+
+@tracing.traced("analyze_agent")
+def analyze_agent_df(agent_df):
+    tracing.annotate(rows=len(agent_df))
     anomalies = {}
 
     # Duplicate agents
@@ -50,7 +63,11 @@ def analyze_agent_file(file_path):
 
 # Generate Vehicle File Anomaly Report
 def analyze_vehicle_file(file_path):
-    vehicle_df = pd.read_csv(file_path)
+    return analyze_vehicle_df(pd.read_csv(file_path))
+
+@tracing.traced("analyze_vehicle")
+def analyze_vehicle_df(vehicle_df):
+    tracing.annotate(rows=len(vehicle_df))
     anomalies = {}
 
     # Duplicate vehicles
@@ -69,30 +86,24 @@ def analyze_vehicle_file(file_path):
 
     return anomalies
 
-# Compile Report as HTML
-def compile_report(agents_anomalies, vehicles_anomalies):
-    report = "<html><body><h1>Anomaly Report</h1><br><p>We compiled a list of anomalies found, take a look at the data below</p>"
-    report += "<h2>Agent File</h2>"
-    for key, df in agents_anomalies.items():
-        report += f"<h3><br>{key}</h3>"
-        report += df.to_html(index=False) if not df.empty else "<p>No anomalies detected.</p>"
-
-    report += "<h2>Vehicle File</h2>"
-    for key, df in vehicles_anomalies.items():
-        report += f"<h3>{key}</h3>"
-        report += df.to_html(index=False) if not df.empty else "<p>No anomalies detected.</p>"
-
-    report += "</body></html>"
-    return report
+# Compile Report as HTML, full anomaly results are attached as compressed files
+@tracing.traced("compile_report")
+def compile_report(agents_anomalies, vehicles_anomalies, integrity_anomalies=None, attachment_folder=None, trend_anomalies=None):
+    anomalies_by_file = {"Agent File": agents_anomalies, "Vehicle File": vehicles_anomalies}
+    if integrity_anomalies is not None:
+        anomalies_by_file["Referential Integrity"] = integrity_anomalies
+    if trend_anomalies is not None:
+        anomalies_by_file["Trends"] = trend_anomalies
+    return report_builder.build_report(anomalies_by_file, attachment_folder)
 
 # Send Email with Report
-def send_email(report, recipient_email):
+@tracing.traced("queue_email")
+def send_email(report, recipient_email, attachment_paths=()):
 
     subject = "Anomaly Detection Report"
     sender_email = os.environ["SENDER_EMAIL"]
-    sender_password = os.environ["SENDER_PASS"]
 
-    msg = MIMEMultipart("alternative")
+    msg = MIMEMultipart("mixed")
     msg["Subject"] = subject
     msg["From"] = sender_email
     msg["To"] = recipient_email
@@ -101,30 +112,79 @@ def send_email(report, recipient_email):
     html_part = MIMEText(report, "html")
     msg.attach(html_part)
 
-    # Send email
-    with smtplib.SMTP("smtp.gmail.com", 587) as server:
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, recipient_email, msg.as_string())
-        print("Email sent successfully!")
+    # Attach the full anomaly results
+    for path in attachment_paths:
+        with open(path, 'rb') as file:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(file.read())
+            encoders.encode_base64(part)
+            part.add_header(
+                'Content-Disposition',
+                f'attachment; filename={os.path.basename(path)}'
+            )
+            msg.attach(part)
+
+    # Queue the email, the notifier delivers it in the background and retries on failure
+    notifier.enqueue(msg, recipient_email)
+    print("Email queued for delivery")
 
 
 
+# Worker tasks for the parallel mode, each one receives the shared sheets it asked for
+def agent_task(sheets):
+    return analyze_agent_df(sheets["agent"])
+
+def vehicle_task(sheets):
+    return analyze_vehicle_df(sheets["vehicule"])
+
+def integrity_task(sheets):
+    return integrity_checker.check_referential_integrity(sheets)
+
+ANALYSIS_TASKS = {
+    "Agent File": (agent_task, ["agent"]),
+    "Vehicle File": (vehicle_task, ["vehicule"]),
+    "Referential Integrity": (integrity_task, ["agent", "vehicule", "intervention"]),
+}
+
+
 # Main Workflow
 # if __name__ == "__main__":
-def execute():
+# ANOMALY_WORKERS > 1 analyzes the sheets in parallel worker processes
+# period ("week", "month" or "year") sets the window of the trend sections
+@tracing.traced("anomaly_execute")
+def execute(max_workers=None, period="month"):
     current_wd = os.getcwd()
     print(current_wd)
     sheet_folder_path = f"{current_wd}/files/sheets"
+    max_workers = max_workers or int(os.getenv("ANOMALY_WORKERS", "1"))
     print("Preparing to analyze")
-    agent_anomalies = analyze_agent_file(f"{sheet_folder_path}/agent.csv")
-    print("Analyzed Agent File")
-    vehicle_anomalies = analyze_vehicle_file(f"{sheet_folder_path}/vehicule.csv")
-    print("Analyzed Vehicle File")
+    if max_workers > 1:
+        results = parallel_runner.run_tasks(ANALYSIS_TASKS, sheet_folder_path, max_workers)
+        agent_anomalies = results["Agent File"]
+        vehicle_anomalies = results["Vehicle File"]
+        integrity_anomalies = results["Referential Integrity"]
+    else:
+        agent_anomalies = analyze_agent_file(f"{sheet_folder_path}/agent.csv")
+        print("Analyzed Agent File")
+        vehicle_anomalies = analyze_vehicle_file(f"{sheet_folder_path}/vehicule.csv")
+        print("Analyzed Vehicle File")
+        integrity_anomalies = integrity_checker.analyze_integrity(sheet_folder_path)
+        print("Analyzed Referential Integrity")
+
+    # Keep the run in the history and compare it with the previous ones
+    anomaly_history.record_run({
+        "Agent File": agent_anomalies,
+        "Vehicle File": vehicle_anomalies,
+        "Referential Integrity": integrity_anomalies,
+    })
+    trend_anomalies = anomaly_history.trend_sections(period)
 
     # Compile and send the report
-    email_report = compile_report(agent_anomalies, vehicle_anomalies)
+    email_report, attachments = compile_report(
+        agent_anomalies, vehicle_anomalies, integrity_anomalies,
+        attachment_folder=f"{current_wd}/files/anomalies/report",
+        trend_anomalies=trend_anomalies
+    )
     print("Compiled Report")
     receiver_email = os.environ["RECEIVER_EMAIL"]
-    send_email(email_report, receiver_email)
-    print("Email Sent")
+    send_email(email_report, receiver_email, attachments)
@@ -0,0 +1,256 @@
+import os
+import re
+import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from utils import tracing
+
+# Append-only history, one Parquet file per run partitioned by day: history/run_date=YYYY-MM-DD/run-<time>.parquet
+HISTORY_FOLDER_PATH = os.getenv("ANOMALY_HISTORY_PATH", f"{os.getcwd()}/files/anomalies/history")
+
+# Primary key column of each sheet, the first one present in an anomaly row identifies the entity
+ENTITY_COLUMNS = {
+    "codeintervention": "intervention",
+    "codevehicule": "vehicule",
+    "codeagent": "agent",
+}
+
+HISTORY_SCHEMA = pa.schema([
+    ("run_ts", pa.timestamp("us")),
+    ("file", pa.string()),
+    ("rule", pa.string()),
+    ("entity_type", pa.string()),
+    ("entity_code", pa.string()),
+])
+
+# First-seen index, one row per anomaly ever seen with the runs it was first and last seen in. It stays small
+# and answers the "opened" queries without reading the runs, and narrows entity lookups to the days it was seen.
+# The leading underscore keeps it out of the run dataset
+INDEX_FILE_NAME = "_first_seen.parquet"
+INDEX_COLUMNS = ["file", "rule", "entity_type", "entity_code"]
+INDEX_SCHEMA = pa.schema([
+    ("file", pa.string()),
+    ("rule", pa.string()),
+    ("entity_type", pa.string()),
+    ("entity_code", pa.string()),
+    ("opened_at", pa.timestamp("us")),
+    ("last_seen", pa.timestamp("us")),
+])
+
+_partitioning = ds.partitioning(pa.schema([("run_date", pa.string())]), flavor="hive")
+
+
+# Function to turn the anomaly groups of one run into one row per (rule, entity)
+def flatten_anomalies(anomalies_by_file, run_ts):
+    frames = []
+    for file_title, anomalies in anomalies_by_file.items():
+        for rule, df in anomalies.items():
+            entity_column = next((col for col in ENTITY_COLUMNS if col in df.columns), None)
+            if df.empty or entity_column is None:
+                continue
+            frames.append(pd.DataFrame({
+                "run_ts": run_ts,
+                "file": file_title,
+                "rule": rule,
+                "entity_type": ENTITY_COLUMNS[entity_column],
+                "entity_code": df[entity_column].astype(str).values,
+            }))
+    if not frames:
+        return pd.DataFrame({field.name: pd.Series(dtype=object) for field in HISTORY_SCHEMA})
+    return pd.concat(frames, ignore_index=True).drop_duplicates()
+
+
+# Function to append a run to the history and update the first-seen index
+@tracing.traced("record_history")
+def record_run(anomalies_by_file, run_ts=None):
+    run_ts = pd.Timestamp(run_ts or datetime.datetime.now()).floor("us")
+    history_df = flatten_anomalies(anomalies_by_file, run_ts)
+    history_df = history_df.sort_values(["rule", "entity_code"]).reset_index(drop=True)
+
+    partition_path = f"{HISTORY_FOLDER_PATH}/run_date={run_ts.date().isoformat()}"
+    os.makedirs(partition_path, exist_ok=True)
+    table = pa.Table.from_pandas(history_df, schema=HISTORY_SCHEMA, preserve_index=False)
+    # Runs without anomalies still get an empty file, so they count as runs that resolved everything
+    pq.write_table(table, f"{partition_path}/run-{run_ts.strftime('%H%M%S%f')}.parquet", row_group_size=10000)
+
+    if os.path.exists(index_path()):
+        update_index(history_df, run_ts)
+    else:
+        rebuild_index()
+    tracing.annotate(rows=len(history_df))
+    print(f"Recorded {len(history_df)} anomaly row(s) in the history")
+    return history_df
+
+
+def index_path():
+    return f"{HISTORY_FOLDER_PATH}/{INDEX_FILE_NAME}"
+
+
+def write_index(index_df):
+    index_df = index_df.sort_values(["entity_type", "opened_at", "entity_code"]).reset_index(drop=True)
+    table = pa.Table.from_pandas(index_df[INDEX_SCHEMA.names], schema=INDEX_SCHEMA, preserve_index=False)
+    temp_path = f"{index_path()}.tmp"
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, index_path())
+
+
+# Function to rebuild the index from every run, only needed for a history recorded before the index existed
+def rebuild_index():
+    history_df = load_history()
+    index_df = history_df.groupby(INDEX_COLUMNS, as_index=False).agg(
+        opened_at=("run_ts", "min"), last_seen=("run_ts", "max")
+    )
+    write_index(index_df)
+    return index_df
+
+
+# Function to add the anomalies of a run to the index: new ones are opened now, known ones are seen again
+def update_index(history_df, run_ts):
+    index_df = pq.read_table(index_path()).to_pandas()
+    seen = history_df[INDEX_COLUMNS].drop_duplicates().assign(seen=True)
+    index_df = index_df.merge(seen, how="outer", on=INDEX_COLUMNS)
+    index_df["opened_at"] = index_df["opened_at"].fillna(run_ts)
+    index_df.loc[index_df["seen"].notna(), "last_seen"] = run_ts
+    write_index(index_df)
+
+
+# Function to read the index, filters is a list of (column, operator, value) pushed down to the Parquet reader
+def load_index(filters=None):
+    if not os.path.exists(index_path()):
+        if not list_runs():
+            return pd.DataFrame({field.name: pd.Series(dtype=object) for field in INDEX_SCHEMA})
+        rebuild_index()
+    return pq.read_table(index_path(), filters=filters or None).to_pandas()
+
+
+# Function to query the history, filters on the date partition, rule and entity code are pushed down
+def load_history(start=None, end=None, rule=None, entity_code=None, entity_type=None):
+    if not os.path.isdir(HISTORY_FOLDER_PATH):
+        return pd.DataFrame(columns=HISTORY_SCHEMA.names + ["run_date"])
+
+    dataset = ds.dataset(HISTORY_FOLDER_PATH, format="parquet", partitioning=_partitioning, schema=HISTORY_SCHEMA.append(pa.field("run_date", pa.string())))
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field("run_date") >= pd.Timestamp(start).date().isoformat())
+    if end is not None:
+        conditions.append(ds.field("run_date") <= pd.Timestamp(end).date().isoformat())
+    if rule is not None:
+        conditions.append(ds.field("rule") == rule)
+    if entity_code is not None:
+        conditions.append(ds.field("entity_code") == entity_code)
+    if entity_type is not None:
+        conditions.append(ds.field("entity_type") == entity_type)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(filter=expression).to_pandas()
+
+
+# Function to list the anomalies seen for the first time between start and end, read from the index
+def opened_anomalies(start, end=None, entity_type=None):
+    filters = [("opened_at", ">=", pd.Timestamp(start))]
+    if end is not None:
+        # end is a day, every run of that day is included
+        filters.append(("opened_at", "<", pd.Timestamp(end).normalize() + pd.Timedelta(days=1)))
+    if entity_type is not None:
+        filters.append(("entity_type", "==", entity_type))
+    opened = load_index(filters)
+    return opened[INDEX_COLUMNS + ["opened_at"]].reset_index(drop=True)
+
+
+# Function to list every occurrence of an entity, only the days between its first and last sighting are read
+def entity_history(entity_code):
+    sightings = load_index([("entity_code", "==", entity_code)])
+    if sightings.empty:
+        return pd.DataFrame(columns=HISTORY_SCHEMA.names + ["run_date"])
+    history_df = load_history(start=sightings["opened_at"].min(), end=sightings["last_seen"].max(), entity_code=entity_code)
+    return history_df.sort_values("run_ts").reset_index(drop=True)
+
+
+# Function to count the opened anomalies per entity, e.g. anomalies opened this month per vehicle
+def opened_per_entity(start, end=None, entity_type="vehicule"):
+    opened = opened_anomalies(start, end, entity_type)
+    if opened.empty:
+        return pd.DataFrame(columns=["entity_code", "opened_anomalies", "rules"])
+    return (
+        opened.groupby("entity_code")
+        .agg(opened_anomalies=("rule", "size"), rules=("rule", lambda rules: ", ".join(sorted(set(rules)))))
+        .sort_values("opened_anomalies", ascending=False)
+        .reset_index()
+    )
+
+
+# Function to list the run files, oldest first, empty runs included
+def list_runs():
+    if not os.path.isdir(HISTORY_FOLDER_PATH):
+        return []
+    return sorted(
+        f"{HISTORY_FOLDER_PATH}/{partition}/{name}"
+        for partition in os.listdir(HISTORY_FOLDER_PATH) if partition.startswith("run_date=")
+        for name in os.listdir(f"{HISTORY_FOLDER_PATH}/{partition}") if name.endswith(".parquet")
+    )
+
+
+# Function to compare the last two runs, returns the new and the resolved anomalies
+def changes_since_previous_run():
+    columns = ["file", "rule", "entity_type", "entity_code"]
+    runs = [pq.read_table(path, columns=columns).to_pandas() for path in list_runs()[-2:]]
+    if not runs:
+        empty = pd.DataFrame(columns=columns)
+        return empty, empty
+    latest = runs[-1]
+    previous = runs[0] if len(runs) == 2 else pd.DataFrame(columns=columns)
+
+    merged = latest.merge(previous, how="outer", on=columns, indicator=True)
+    new = merged[merged["_merge"] == "left_only"][columns].reset_index(drop=True)
+    resolved = merged[merged["_merge"] == "right_only"][columns].reset_index(drop=True)
+    return new, resolved
+
+
+# Function to return the start of the current week, month or year
+def period_start(period="month", today=None):
+    today = pd.Timestamp(today or datetime.date.today()).normalize()
+    if period == "week":
+        return today - pd.Timedelta(days=today.weekday())
+    if period == "year":
+        return today.replace(month=1, day=1)
+    return today.replace(day=1)
+
+
+# Function to build the trend sections added to the anomaly report
+@tracing.traced("trend_queries")
+def trend_sections(period="month"):
+    start = period_start(period)
+    new, resolved = changes_since_previous_run()
+    return {
+        "New Since Previous Run": new,
+        "Resolved Since Previous Run": resolved,
+        f"Anomalies Opened This {period.capitalize()} per Vehicle": opened_per_entity(start, entity_type="vehicule"),
+        f"Anomalies Opened This {period.capitalize()} per Agent": opened_per_entity(start, entity_type="agent"),
+    }
+
+
+# Function to answer a chat history query such as "history of vehic128202400000006"
+# or "history this week per agent", returns a DataFrame
+def history_query(instruction):
+    code_match = re.search(r"\b((?:agent|vehic|intrv)\d\w*)\b", instruction)
+    if code_match:
+        return entity_history(code_match.group(1))
+
+    if re.search(r"\b(week|semaine)\b", instruction):
+        period = "week"
+    elif re.search(r"\b(year|année|annee)\b", instruction):
+        period = "year"
+    else:
+        period = "month"
+
+    if re.search(r"\bagents?\b", instruction):
+        entity_type = "agent"
+    elif re.search(r"\binterventions?\b", instruction):
+        entity_type = "intervention"
+    else:
+        entity_type = "vehicule"
+    return opened_per_entity(period_start(period), entity_type=entity_type)
@@ -0,0 +1,149 @@
+import os
+import uuid
+import shutil
+import weakref
+import tempfile
+from collections import OrderedDict
+import pandas as pd
+from dotenv import load_dotenv
+from utils.result_view import ResultView
+
+load_dotenv()
+
+# Rows per result page, spilled frames use it as their Parquet row group size so a page is one row group
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "100"))
+# Memory kept by result frames of one session before the least recently viewed ones spill to disk
+CHAT_MEMORY_CAP_MB = float(os.getenv("CHAT_MEMORY_CAP_MB", "200"))
+# Number of most recent messages rendered, older ones are loaded on demand
+CHAT_VISIBLE_MESSAGES = int(os.getenv("CHAT_VISIBLE_MESSAGES", "20"))
+
+
+# Stores the result frames of the chat, in memory up to the cap and as Parquet files beyond it
+# ResultView results are kept as views, they only hold the ids of their rows
+class FrameStore:
+    def __init__(self, memory_cap_mb=CHAT_MEMORY_CAP_MB, page_size=CHAT_PAGE_SIZE):
+        self.memory_cap = memory_cap_mb * 1024 * 1024
+        self.page_size = page_size
+        self.frames = OrderedDict()
+        self.sizes = {}
+        self.spilled = {}
+        self.spill_folder_path = None
+
+    def memory_usage(self):
+        return sum(self.sizes.values())
+
+    def add(self, df):
+        frame_id = uuid.uuid4().hex
+        self.frames[frame_id] = df
+        if isinstance(df, ResultView):
+            self.sizes[frame_id] = df.memory_usage()
+        else:
+            self.sizes[frame_id] = int(df.memory_usage(deep=True).sum())
+        self.enforce_cap(keep=frame_id)
+        return frame_id
+
+    # Spill the least recently used frames until the store fits in its memory cap
+    def enforce_cap(self, keep=None):
+        for frame_id in list(self.frames):
+            if self.memory_usage() <= self.memory_cap:
+                break
+            if frame_id != keep:
+                self.spill(frame_id)
+
+    def spill(self, frame_id):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.spill_folder_path is None:
+            self.spill_folder_path = tempfile.mkdtemp(prefix="sheetbot-chat-")
+            # Streamlit drops the session state when the session ends, the spilled frames go with the store
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self.spill_folder_path, True)
+        df = self.frames.pop(frame_id)
+        self.sizes.pop(frame_id)
+        if isinstance(df, ResultView):
+            df = df.to_frame()
+        # Mixed object columns are stored as strings, the pages are only displayed
+        df = df.copy()
+        for col in df.select_dtypes("object").columns:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        path = f"{self.spill_folder_path}/{frame_id}.parquet"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=True), path, row_group_size=self.page_size)
+        self.spilled[frame_id] = path
+
+    def row_count(self, frame_id):
+        if frame_id in self.frames:
+            return len(self.frames[frame_id])
+        if frame_id in self.spilled:
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(self.spilled[frame_id]).metadata.num_rows
+        return 0
+
+    def page_count(self, frame_id):
+        return max((self.row_count(frame_id) + self.page_size - 1) // self.page_size, 1)
+
+    # Return one page of a frame, spilled frames only read the row group of that page
+    def get_page(self, frame_id, page=0):
+        if frame_id in self.frames:
+            self.frames.move_to_end(frame_id)
+            if isinstance(self.frames[frame_id], ResultView):
+                return self.frames[frame_id].page(page, self.page_size)
+            start = page * self.page_size
+            return self.frames[frame_id].iloc[start:start + self.page_size]
+        if frame_id in self.spilled:
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(self.spilled[frame_id])
+            if page >= parquet_file.num_row_groups:
+                return pd.DataFrame()
+            return parquet_file.read_row_group(page).to_pandas()
+        return pd.DataFrame()
+
+    # Views point to the session frame, once it is replaced (reconnect, restored version) a view would keep
+    # the whole old frame alive without it being counted, so only its own rows are copied out of it
+    def detach_views(self, session_df):
+        for frame_id, df in list(self.frames.items()):
+            if isinstance(df, ResultView) and df.df is not session_df:
+                self.frames[frame_id] = df.to_frame()
+                self.sizes[frame_id] = int(self.frames[frame_id].memory_usage(deep=True).sum())
+        self.enforce_cap()
+
+    def clear(self):
+        self.frames.clear()
+        self.sizes.clear()
+        self.spilled.clear()
+        if self.spill_folder_path is not None:
+            self._cleanup()
+            self.spill_folder_path = None
+
+
+# Chat messages of one session, result frames are kept in the FrameStore and messages only hold a reference
+class ChatHistory:
+    def __init__(self, visible_messages=CHAT_VISIBLE_MESSAGES):
+        self.messages = []
+        self.store = FrameStore()
+        self.visible = visible_messages
+
+    def add_text(self, sender, content):
+        self.messages.append({"sender": sender, "type": "text", "content": content})
+
+    def add_dataframe(self, sender, df):
+        self.messages.append({
+            "sender": sender,
+            "type": "dataframe",
+            "frame_id": self.store.add(df),
+            "rows": len(df),
+            "columns": len(df.columns),
+        })
+
+    # Messages to render, only the most recent ones until older ones are requested
+    def visible_messages(self):
+        return self.messages[-self.visible:]
+
+    def hidden_count(self):
+        return max(len(self.messages) - self.visible, 0)
+
+    def show_older(self, count=CHAT_VISIBLE_MESSAGES):
+        self.visible += count
+
+    def clear(self):
+        self.messages = []
+        self.store.clear()
@@ -1,7 +1,7 @@
 import os
-import psycopg2
 import pandas as pd
 from dotenv import load_dotenv
+from utils import tracing
 
 load_dotenv()
 
@@ -14,16 +14,21 @@ def get_all_tables(conn):
     # print(table_names)
     return table_names
 
+@tracing.traced("fetch_data")
 def fetch_data_to_dataframe(conn, query_dict):
 
     df_list= []
     for query in query_dict:
         # df = pd.read_sql_query(query_dict[query], conn)
+        read_span = tracing.start_span("read_sql", table=query)
         df = pd.read_sql_query(query_dict[query], conn, coerce_float=True)
+        read_span.end(rows=len(df))
         try:
 
+            encode_span = tracing.start_span("encode_utf8", table=query, rows=len(df))
             df = df.applymap(lambda x: x.encode('utf-8', errors='replace').decode('utf-8') 
                              if isinstance(x, str) else x)
+            encode_span.end()
                             #  SELECT convert(column_name USING UTF8) AS column_name FROM rep.table_name;
             if df.empty:
                 print(f"Table '{query}' is empty. Skipping...")
@@ -38,7 +43,9 @@ def fetch_data_to_dataframe(conn, query_dict):
                     df = df.iloc[1:].reset_index(drop=True)
 
                 df["source_table"] = query
+                text_span = tracing.start_span("searchable_text", table=query, rows=len(df))
                 df["searchable_text"] = df.apply(lambda row: " ".join(map(str, row)), axis=1)
+                text_span.end()
                 df_list.append(df)
         except UnicodeDecodeError as e:
             print(f"UnicodeDecodeError in table '{query}': {e}. Skipping this table...")
@@ -50,6 +57,7 @@ def fetch_data_to_dataframe(conn, query_dict):
 
     return df_list
 
+@tracing.traced("clean_data")
 def clean_data(df_list):
 
     # Combine all DataFrames
@@ -85,7 +93,10 @@ def clean_data(df_list):
     return df
 
 
+@tracing.traced("extract_database")
 def main(db_user, db_password, db_host, db_port, db_name):
+    import psycopg2
+
     conn = psycopg2.connect(
         database= db_name,
         user= db_user,
@@ -103,6 +114,7 @@ def main(db_user, db_password, db_host, db_port, db_name):
     conn.close()
 
     cleaned_df = clean_data(df_list[::-1])
+    tracing.annotate(rows=len(cleaned_df))
     # print(cleaned_df.head(1))
     return cleaned_df
 
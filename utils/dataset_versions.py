@@ -0,0 +1,227 @@
+import os
+import gzip
+import json
+import zlib
+import hashlib
+import threading
+from datetime import datetime
+import pandas as pd
+from dotenv import load_dotenv
+from utils import tracing
+
+load_dotenv()
+
+# Versions of a saved dataset: content addressed chunks of its CSV text shared between versions, and one
+# manifest per version listing its chunks: .versions/chunks/ab/<sha256>.csv.gz, .versions/manifests/<dataset>/<version>.json
+# The store is kept next to each file unless VERSIONS_FOLDER_PATH sets one folder for all of them
+VERSIONS_FOLDER_PATH = os.getenv("VERSIONS_FOLDER_PATH")
+# Average lines per chunk, boundaries depend on the line content so an edit only changes the chunks around it
+VERSION_CHUNK_ROWS = int(os.getenv("VERSION_CHUNK_ROWS", "256"))
+# Versions kept per dataset, the older ones and the chunks only they used are deleted
+VERSION_RETENTION = int(os.getenv("VERSION_RETENTION", "20"))
+# gzip level of the chunks, a low level keeps the saves fast
+VERSION_COMPRESSION_LEVEL = int(os.getenv("VERSION_COMPRESSION_LEVEL", "1"))
+
+_lock = threading.Lock()
+
+
+def versions_folder(file_path):
+    return VERSIONS_FOLDER_PATH or f"{os.path.dirname(os.path.abspath(file_path))}/.versions"
+
+
+# Function to name the history of a file, the full path is part of it so files with the same
+# name in other folders (e.g. a benchmark workspace) never share or prune each other's versions
+def dataset_key(file_path):
+    path = os.path.abspath(file_path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return f"{name}-{hashlib.sha256(path.encode()).hexdigest()[:12]}"
+
+
+def manifest_folder(file_path):
+    return f"{versions_folder(file_path)}/manifests/{dataset_key(file_path)}"
+
+
+def chunk_path(root, digest):
+    return f"{root}/chunks/{digest[:2]}/{digest}.csv.gz"
+
+
+# Function to split the CSV text into chunks, a chunk ends after a line whose checksum is a multiple of
+# the average size, so inserting or deleting rows does not shift the boundaries of the other chunks
+# Chunks are byte ranges of the file, a quoted value spanning lines may be cut without harm
+def split_chunks(text, average_lines=VERSION_CHUNK_ROWS):
+    chunks = []
+    start = 0
+    position = 0
+    for line in text.split("\n"):
+        position += len(line) + 1
+        if zlib.crc32(line.encode()) % average_lines == 0:
+            chunks.append(text[start:position])
+            start = position
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+# Function to store the chunks of a CSV text, only the chunks not stored yet are compressed and written
+def write_chunks(text, root):
+    digests = []
+    written = 0
+    for chunk in split_chunks(text):
+        data = chunk.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = chunk_path(root, digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = gzip.compress(data, compresslevel=VERSION_COMPRESSION_LEVEL)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(compressed)
+            os.replace(temp_path, path)
+            written += len(compressed)
+        digests.append(digest)
+    tracing.annotate(chunks=len(digests), bytes=written)
+    return digests
+
+
+def manifest_names(file_path):
+    folder_path = manifest_folder(file_path)
+    if not os.path.isdir(folder_path):
+        return []
+    return sorted(name for name in os.listdir(folder_path) if name.endswith(".json"))
+
+
+def read_manifest(file_path, name):
+    with open(f"{manifest_folder(file_path)}/{name}") as file:
+        return json.load(file)
+
+
+def list_versions(file_path):
+    return [read_manifest(file_path, name) for name in manifest_names(file_path)]
+
+
+def latest_version(file_path):
+    names = manifest_names(file_path)
+    return read_manifest(file_path, names[-1]) if names else None
+
+
+def write_manifest(file_path, manifest):
+    folder_path = manifest_folder(file_path)
+    os.makedirs(folder_path, exist_ok=True)
+    with open(f"{folder_path}/{manifest['id']}.json", "w") as file:
+        json.dump(manifest, file)
+
+
+def new_manifest(trigger, columns, rows, chunks):
+    return {
+        "id": datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "trigger": trigger,
+        "columns": columns,
+        "rows": rows,
+        "chunks": chunks,
+    }
+
+
+# Function to record a CSV text as a version, nothing is recorded when it matches the latest version
+# The caller holds _lock, so the file, the chunks and the latest manifest always change together
+@tracing.traced("snapshot")
+def snapshot(text, file_path, trigger, columns, rows):
+    tracing.annotate(rows=rows)
+    chunks = write_chunks(text, versions_folder(file_path))
+    latest = latest_version(file_path)
+    if latest is not None and latest["chunks"] == chunks:
+        return latest
+    manifest = new_manifest(trigger, columns, rows, chunks)
+    write_manifest(file_path, manifest)
+    prune(file_path)
+    return manifest
+
+
+# Function to version the file as it was before the store existed, so its content can be restored too
+def record_initial(file_path):
+    if latest_version(file_path) is not None or not os.path.exists(file_path):
+        return
+    with open(file_path, encoding="utf-8", newline="") as file:
+        text = file.read()
+    header = text.split("\n", 1)[0]
+    snapshot(text, file_path, "initial", header.split(","), max(text.count("\n") - 1, 0))
+
+
+# Function to version a frame without writing it to the file, e.g. the data loaded from the database
+# on Connect: it is what the next save changes, so it must be restorable even if it was never saved
+def record(df, file_path, trigger):
+    with _lock:
+        record_initial(file_path)
+        return snapshot(df.to_csv(index=False), file_path, trigger, [str(col) for col in df.columns], len(df))
+
+
+# Function to write a frame to its CSV file and record it as a version, the CSV text is serialized once for both
+def save(df, file_path, trigger):
+    with _lock:
+        record_initial(file_path)
+        with tracing.span("write_csv", rows=len(df)) as current:
+            text = df.to_csv(index=False)
+            with open(file_path, "w", encoding="utf-8", newline="") as file:
+                file.write(text)
+            current.set(bytes=os.path.getsize(file_path))
+        return snapshot(text, file_path, trigger, [str(col) for col in df.columns], len(df))
+
+
+# Function to rebuild the CSV text of a version from its chunks
+def read_version(file_path, manifest):
+    root = versions_folder(file_path)
+    parts = []
+    for digest in manifest["chunks"]:
+        with gzip.open(chunk_path(root, digest), "rt", encoding="utf-8", newline="") as file:
+            parts.append(file.read())
+    return "".join(parts)
+
+
+# Function to restore a version to the CSV file, the rollback is itself recorded as a version
+# pointing to the same chunks so it can be undone, returns the restored frame
+@tracing.traced("rollback")
+def rollback(file_path, version_id):
+    with _lock:
+        versions = {version["id"]: version for version in list_versions(file_path)}
+        if version_id not in versions:
+            raise ValueError(f"Unknown version '{version_id}' of {os.path.basename(file_path)}.")
+        manifest = versions[version_id]
+        text = read_version(file_path, manifest)
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8", newline="") as file:
+            file.write(text)
+        os.replace(temp_path, file_path)
+        tracing.annotate(rows=manifest["rows"], bytes=len(text))
+
+        restored = new_manifest(f"rollback to {version_id}", manifest["columns"], manifest["rows"], manifest["chunks"])
+        write_manifest(file_path, restored)
+        prune(file_path)
+    return pd.read_csv(file_path)
+
+
+# Function to apply the retention policy, then delete the chunks no manifest refers to anymore
+def prune(file_path, retention=VERSION_RETENTION):
+    names = manifest_names(file_path)
+    if len(names) <= retention:
+        return 0
+    folder_path = manifest_folder(file_path)
+    for name in names[:-retention]:
+        os.remove(f"{folder_path}/{name}")
+
+    # Chunks are shared by the datasets of the same store, every remaining manifest is checked
+    root = versions_folder(file_path)
+    referenced = set()
+    for dataset in os.listdir(f"{root}/manifests"):
+        for name in os.listdir(f"{root}/manifests/{dataset}"):
+            with open(f"{root}/manifests/{dataset}/{name}") as file:
+                referenced.update(json.load(file)["chunks"])
+
+    removed = 0
+    chunks_folder_path = f"{root}/chunks"
+    for prefix in os.listdir(chunks_folder_path):
+        for name in os.listdir(f"{chunks_folder_path}/{prefix}"):
+            if name.split(".")[0] not in referenced:
+                os.remove(f"{chunks_folder_path}/{prefix}/{name}")
+                removed += 1
+    print(f"Pruned {len(names) - retention} version(s) and {removed} chunk(s) of {os.path.basename(file_path)}")
+    return removed
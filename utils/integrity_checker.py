@@ -0,0 +1,82 @@
+import pandas as pd
+from utils import tracing
+
+# Foreign key columns of each sheet and the (sheet, primary key) they reference
+FOREIGN_KEYS = {
+    "intervention": {
+        "agentresponsable": ("agent", "codeagent"),
+        "agentoperationnel": ("agent", "codeagent"),
+        "agentreparation": ("agent", "codeagent"),
+    },
+    "vehicule": {
+        "agentchauffeur": ("agent", "codeagent"),
+    },
+}
+
+# Primary key of each sheet
+PRIMARY_KEYS = {
+    "agent": "codeagent",
+    "vehicule": "codevehicule",
+    "intervention": "codeintervention",
+}
+
+
+# Function to load the sheets needed by the integrity checks
+def load_sheets(sheet_folder_path):
+    sheets = {}
+    for sheet in PRIMARY_KEYS:
+        # Read key columns as strings so codes are never coerced to floats
+        key_columns = [PRIMARY_KEYS[sheet]] + list(FOREIGN_KEYS.get(sheet, {}))
+        sheets[sheet] = pd.read_csv(
+            f"{sheet_folder_path}/{sheet}.csv",
+            dtype={col: str for col in key_columns},
+        )
+    return sheets
+
+
+# Function to build the hashed primary key sets, once per referenced sheet
+def build_key_sets(sheets):
+    key_sets = {}
+    for references in FOREIGN_KEYS.values():
+        for ref_sheet, ref_column in references.values():
+            if (ref_sheet, ref_column) in key_sets or ref_sheet not in sheets:
+                continue
+            keys = sheets[ref_sheet][ref_column].dropna().astype(str).str.strip()
+            # pd.Index is backed by a hash table, so isin() lookups are O(1) per row
+            key_sets[(ref_sheet, ref_column)] = pd.Index(keys.unique())
+    return key_sets
+
+
+# Function to find rows whose foreign key does not exist in the referenced keys
+def find_orphans(df, column, keys):
+    values = df[column]
+    # Empty references are optional links, not orphans
+    present = values.notna() & (values.astype(str).str.strip() != "")
+    orphaned = present & ~values.astype(str).str.strip().isin(keys)
+    return df[orphaned]
+
+
+# Function to validate every foreign key column across the sheets
+@tracing.traced("referential_integrity")
+def check_referential_integrity(sheets):
+    tracing.annotate(rows=sum(len(df) for df in sheets.values()))
+    key_sets = build_key_sets(sheets)
+    anomalies = {}
+
+    for sheet, references in FOREIGN_KEYS.items():
+        if sheet not in sheets:
+            continue
+        df = sheets[sheet]
+        for column, (ref_sheet, ref_column) in references.items():
+            if column not in df.columns or (ref_sheet, ref_column) not in key_sets:
+                continue
+            anomalies[f"Orphaned {column} ({sheet}.csv)"] = find_orphans(
+                df, column, key_sets[(ref_sheet, ref_column)]
+            )
+
+    return anomalies
+
+
+# Generate Referential Integrity Anomaly Report
+def analyze_integrity(sheet_folder_path):
+    return check_referential_integrity(load_sheets(sheet_folder_path))
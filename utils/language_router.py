@@ -0,0 +1,98 @@
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seed of langdetect, it samples n-grams randomly and gives different answers without one
+LANGDETECT_SEED = int(os.getenv("LANGDETECT_SEED", "0"))
+# Maximum number of detections kept per session
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "256"))
+
+# Frequent words of the supported languages, used when the instruction keywords are not enough
+COMMON_WORDS = {
+    "en": {"the", "what", "which", "who", "how", "many", "much", "show", "list", "all", "and", "with", "are", "for", "in", "records", "vehicle", "vehicles"},
+    "fr": {"le", "la", "les", "des", "du", "un", "une", "quel", "quelle", "quels", "qui", "combien", "afficher", "liste", "tous", "et", "avec", "sont", "pour", "dans", "enregistrements", "véhicule", "véhicules"},
+}
+
+_detect = None
+_vocabularies = {}
+
+
+# Function to build the word -> language table, words used by several languages are dropped
+def build_vocabulary(keyword_tables):
+    languages_by_word = {}
+    for language, words in COMMON_WORDS.items():
+        for word in words:
+            languages_by_word.setdefault(word, set()).add(language)
+    for table in keyword_tables:
+        for words in table.values():
+            for language, language_words in words.items():
+                for word in language_words:
+                    languages_by_word.setdefault(word, set()).add(language)
+    return {word: languages.pop() for word, languages in languages_by_word.items() if len(languages) == 1}
+
+
+# Function to guess the language from the known vocabulary, returns None when it is ambiguous
+def detect_from_keywords(text, vocabulary):
+    text = text.lower()
+    tokens = re.findall(r"\w+", text)
+    scores = {}
+    for token in tokens:
+        if token in vocabulary:
+            scores[vocabulary[token]] = scores.get(vocabulary[token], 0) + 1
+    # Multi word keywords such as "greater than" or "supérieur à"
+    for phrase, language in vocabulary.items():
+        if " " in phrase and phrase in text:
+            scores[language] = scores.get(language, 0) + 1
+
+    if not scores:
+        return None
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+        return None
+    return ranked[0][0]
+
+
+# Function to run langdetect, imported on first use since loading its profiles is slow
+def detect_with_langdetect(text):
+    global _detect
+    if _detect is None:
+        from langdetect import DetectorFactory, detect
+        DetectorFactory.seed = LANGDETECT_SEED
+        _detect = detect
+    return _detect(text)
+
+
+# Function to detect the language of a message: cache, then keywords, then langdetect
+def detect_language(text, keyword_tables=(), cache=None):
+    key = text.strip().lower()
+    if cache is not None and key in cache:
+        return cache[key]
+
+    vocabulary = get_vocabulary(keyword_tables)
+    language = detect_from_keywords(key, vocabulary) or detect_with_langdetect(text)
+
+    if cache is not None:
+        if len(cache) >= LANGUAGE_CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+        cache[key] = language
+    return language
+
+
+# Function to turn keyword tables into a hashable key, {key: {language: [words]}} -> nested tuples
+def freeze_tables(keyword_tables):
+    return tuple(
+        tuple(sorted((key, tuple(sorted((language, tuple(words)) for language, words in words_by_language.items())))
+                     for key, words_by_language in table.items()))
+        for table in keyword_tables
+    )
+
+
+# Function to return the vocabulary of the keyword tables, built once per distinct tables
+# The key is their content: Streamlit reruns the main script and builds new table objects on every run
+def get_vocabulary(keyword_tables):
+    key = freeze_tables(keyword_tables)
+    if key not in _vocabularies:
+        _vocabularies[key] = build_vocabulary(keyword_tables)
+    return _vocabularies[key]
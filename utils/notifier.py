@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import uuid
+import smtplib
+import threading
+from email import policy
+from email.parser import BytesParser
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# SMTP settings, point them at a local stub (e.g. `python -m aiosmtpd -n -l localhost:8025`)
+# with SMTP_STARTTLS=0 to test delivery without a real mail server
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+
+# Retry policy: wait RETRY_BASE_DELAY * 2 ** attempts seconds, give up after MAX_ATTEMPTS
+RETRY_BASE_DELAY = float(os.getenv("SMTP_RETRY_BASE_DELAY", "30"))
+RETRY_MAX_DELAY = float(os.getenv("SMTP_RETRY_MAX_DELAY", "3600"))
+MAX_ATTEMPTS = int(os.getenv("SMTP_MAX_ATTEMPTS", "8"))
+
+# Close the SMTP session once it has been idle for this many seconds
+SESSION_IDLE_TIMEOUT = float(os.getenv("SMTP_SESSION_IDLE_TIMEOUT", "60"))
+
+SPOOL_FOLDER_PATH = os.getenv("SMTP_SPOOL_PATH", f"{os.getcwd()}/files/outbox")
+
+_wakeup = threading.Event()
+# The session lock is held during the SMTP exchanges, enqueue never waits for it: it only takes the worker lock
+_session_lock = threading.Lock()
+_worker_lock = threading.Lock()
+_worker = None
+_session = None
+_session_last_used = 0.0
+
+
+# Function to split a comma separated recipient string into a list
+def parse_recipients(recipients):
+    if isinstance(recipients, str):
+        recipients = recipients.split(",")
+    return [recipient.strip() for recipient in recipients if recipient.strip()]
+
+
+# Function to add a message to the disk backed spool, it survives restarts until delivered
+def enqueue(msg, recipients):
+    os.makedirs(f"{SPOOL_FOLDER_PATH}/failed", exist_ok=True)
+    message_id = f"{time.time():.6f}-{uuid.uuid4().hex}"
+
+    with open(f"{SPOOL_FOLDER_PATH}/{message_id}.eml", "wb") as file:
+        file.write(msg.as_bytes())
+    # The metadata file is written last and atomically, it marks the message as ready
+    metadata = {"recipients": parse_recipients(recipients), "attempts": 0, "next_attempt": 0}
+    write_metadata(message_id, metadata)
+
+    start_worker()
+    _wakeup.set()
+    return message_id
+
+
+# Function to atomically write the delivery state of a spooled message
+def write_metadata(message_id, metadata):
+    temp_path = f"{SPOOL_FOLDER_PATH}/{message_id}.json.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(metadata, file)
+    os.replace(temp_path, f"{SPOOL_FOLDER_PATH}/{message_id}.json")
+
+
+# Function to list the spooled message ids, oldest first
+def pending_messages():
+    if not os.path.isdir(SPOOL_FOLDER_PATH):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(SPOOL_FOLDER_PATH) if name.endswith(".json"))
+
+
+# Function to return the open SMTP session, reconnecting when it was dropped
+def get_session():
+    global _session, _session_last_used
+
+    if _session is not None:
+        try:
+            _session.noop()
+        except (smtplib.SMTPException, OSError):
+            _session = None
+
+    if _session is None:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            server.starttls()
+        sender_email = os.getenv("SENDER_EMAIL")
+        password = os.getenv("SENDER_PASS")
+        if sender_email and password:
+            server.login(sender_email, password)
+        _session = server
+
+    _session_last_used = time.time()
+    return _session
+
+
+# Function to close the SMTP session, ignoring errors from an already dropped connection
+def close_session():
+    global _session
+    if _session is not None:
+        try:
+            _session.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _session = None
+
+
+# Function to deliver every due message in the spool over a single SMTP session
+def flush():
+    with _session_lock:
+        now = time.time()
+        sent = 0
+        for message_id in pending_messages():
+            try:
+                with open(f"{SPOOL_FOLDER_PATH}/{message_id}.json") as file:
+                    metadata = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Skipping email {message_id}, its metadata can't be read: {e}")
+                continue
+            if metadata["next_attempt"] > now:
+                continue
+
+            try:
+                with open(f"{SPOOL_FOLDER_PATH}/{message_id}.eml", "rb") as file:
+                    msg = BytesParser(policy=policy.SMTP).parse(file)
+                server = get_session()
+                server.send_message(msg, to_addrs=metadata["recipients"])
+            except (smtplib.SMTPException, OSError) as e:
+                close_session()
+                metadata["attempts"] += 1
+                if metadata["attempts"] >= MAX_ATTEMPTS:
+                    print(f"Giving up on email {message_id} after {metadata['attempts']} attempts: {e}")
+                    write_metadata(message_id, metadata)
+                    for suffix in (".eml", ".json"):
+                        os.replace(f"{SPOOL_FOLDER_PATH}/{message_id}{suffix}", f"{SPOOL_FOLDER_PATH}/failed/{message_id}{suffix}")
+                    continue
+                delay = min(RETRY_BASE_DELAY * 2 ** (metadata["attempts"] - 1), RETRY_MAX_DELAY)
+                metadata["next_attempt"] = now + delay
+                write_metadata(message_id, metadata)
+                print(f"Failed to send email {message_id} (attempt {metadata['attempts']}), retrying in {delay:.0f}s: {e}")
+                continue
+
+            os.remove(f"{SPOOL_FOLDER_PATH}/{message_id}.json")
+            os.remove(f"{SPOOL_FOLDER_PATH}/{message_id}.eml")
+            sent += 1
+            print(f"Email sent to {', '.join(metadata['recipients'])}")
+
+        return sent
+
+
+# Function to compute how long the worker can sleep before the next retry is due
+def next_wakeup_delay():
+    delays = [SESSION_IDLE_TIMEOUT]
+    now = time.time()
+    for message_id in pending_messages():
+        try:
+            with open(f"{SPOOL_FOLDER_PATH}/{message_id}.json") as file:
+                delays.append(json.load(file)["next_attempt"] - now)
+        except (OSError, ValueError):
+            continue
+    return max(min(delays), 0.5)
+
+
+# Function run by the background thread, delivers mail as it is enqueued or retries come due
+def run_worker():
+    while True:
+        _wakeup.wait(next_wakeup_delay())
+        _wakeup.clear()
+        # Any error is logged and the loop goes on, a dead worker would leave the mail in the spool
+        try:
+            flush()
+            with _session_lock:
+                if _session is not None and time.time() - _session_last_used > SESSION_IDLE_TIMEOUT:
+                    close_session()
+        except Exception as e:
+            print(f"Email worker error: {e}")
+            time.sleep(1)
+
+
+# Function to start the background delivery thread, it then delivers everything in the spool
+def start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_worker, daemon=True)
+            _worker.start()
+            _wakeup.set()
+
+
+# Function to deliver the mail spooled by a previous run, called once at startup
+def resume_pending():
+    pending = pending_messages()
+    if pending:
+        print(f"Resuming delivery of {len(pending)} spooled message(s)")
+        start_worker()
@@ -0,0 +1,87 @@
+import os
+import time
+import multiprocessing
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import tracing
+
+# Folder holding the Arrow IPC copies of the sheets shared with the worker processes
+SHARED_FOLDER_NAME = ".arrow"
+# Workers are started fresh instead of forked: the pool is created from the scheduler thread of the
+# Streamlit server, a fork taken while another thread holds a lock (tracing, notifier) could deadlock
+PROCESS_START_METHOD = os.getenv("ANOMALY_START_METHOD", "spawn")
+
+
+# Function to make object columns Arrow compatible, mixed values are stored as strings
+def to_arrow_table(df):
+    for col in df.select_dtypes("object").columns:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+# Function to convert a sheet to an Arrow IPC file once, it is rebuilt only when the CSV changes
+def share_sheet(csv_path, shared_folder_path):
+    os.makedirs(shared_folder_path, exist_ok=True)
+    arrow_path = f"{shared_folder_path}/{os.path.splitext(os.path.basename(csv_path))[0]}.arrow"
+    if os.path.exists(arrow_path) and os.path.getmtime(arrow_path) >= os.path.getmtime(csv_path):
+        return arrow_path
+
+    table = to_arrow_table(pd.read_csv(csv_path))
+    temp_path = f"{arrow_path}.tmp"
+    with pa.OSFile(temp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, arrow_path)
+    return arrow_path
+
+
+# Function to open a shared sheet, the file is memory mapped so numeric buffers are not copied
+def load_shared_sheet(arrow_path):
+    table = pa.ipc.open_file(pa.memory_map(arrow_path, "r")).read_all()
+    return table.to_pandas()
+
+
+# Function executed in the worker process for one task
+def run_task(name, func, arrow_paths):
+    start = time.perf_counter()
+    sheets = {sheet: load_shared_sheet(path) for sheet, path in arrow_paths.items()}
+    loaded = time.perf_counter()
+    result = func(sheets)
+    finished = time.perf_counter()
+    timing = {"load": loaded - start, "analyze": finished - loaded, "total": finished - start, "pid": os.getpid()}
+    return name, result, timing
+
+
+# Function to run each task in its own worker process and merge the results by task name
+# tasks maps a task name to (function, list of sheet names), the function receives a dict of DataFrames
+@tracing.traced("parallel_analysis")
+def run_tasks(tasks, sheet_folder_path, max_workers=None):
+    shared_folder_path = f"{sheet_folder_path}/{SHARED_FOLDER_NAME}"
+    start = time.perf_counter()
+    sheet_names = sorted({sheet for _, sheets in tasks.values() for sheet in sheets})
+    arrow_paths = {sheet: share_sheet(f"{sheet_folder_path}/{sheet}.csv", shared_folder_path) for sheet in sheet_names}
+    print(f"Shared {len(arrow_paths)} sheet(s) in {time.perf_counter() - start:.2f}s")
+
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=max_workers or min(len(tasks), os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context(PROCESS_START_METHOD),
+    ) as executor:
+        futures = [
+            executor.submit(run_task, name, func, {sheet: arrow_paths[sheet] for sheet in sheets})
+            for name, (func, sheets) in tasks.items()
+        ]
+        for future in as_completed(futures):
+            name, result, timing = future.result()
+            results[name] = result
+            print(
+                f"Analyzed {name} in {timing['total']:.2f}s "
+                f"(load {timing['load']:.2f}s, analyze {timing['analyze']:.2f}s, pid {timing['pid']})"
+            )
+
+    print(f"Parallel analysis finished in {time.perf_counter() - start:.2f}s")
+    return results
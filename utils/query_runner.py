@@ -0,0 +1,126 @@
+import time
+import threading
+import contextvars
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+# A chat query running off the Streamlit script thread, the UI polls it for streamed output
+class QueryJob:
+    def __init__(self, instruction):
+        self.instruction = instruction
+        self.started_at = time.time()
+        self.text = ""
+        self.steps = []
+        self.notices = []
+        self.result = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise QueryCancelled()
+
+    def done(self):
+        return self.done_event.is_set()
+
+    def elapsed(self):
+        return time.time() - self.started_at
+
+    def append_token(self, token):
+        with self.lock:
+            self.text += token
+
+    def start_generation(self):
+        with self.lock:
+            self.text = ""
+
+    def add_step(self, step):
+        with self.lock:
+            self.steps.append(step)
+
+    # Status messages (level, text) of the handler, the worker thread cannot show them itself
+    def add_notice(self, level, message):
+        with self.lock:
+            self.notices.append((level, message))
+
+    # Snapshot of the streamed output, safe to read from the script thread
+    def progress(self):
+        with self.lock:
+            return self.text, list(self.steps)
+
+    def get_notices(self):
+        with self.lock:
+            return list(self.notices)
+
+
+# Function to return the job running in the current thread, None on the Streamlit script thread
+def current_job():
+    return _current_job.get()
+
+
+# Function to build the callback handler of a job, LangChain is imported on first use
+def make_callback_handler(job):
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    # Forwards the LLM tokens and agent steps to the job, raising in a callback is how a cancel stops the agent
+    class StreamingCallbackHandler(BaseCallbackHandler):
+        raise_error = True
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            job.check_cancelled()
+            job.start_generation()
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            job.check_cancelled()
+            job.start_generation()
+
+        def on_llm_new_token(self, token, **kwargs):
+            job.check_cancelled()
+            job.append_token(token)
+
+        def on_agent_action(self, action, **kwargs):
+            job.check_cancelled()
+            job.add_step(f"Running `{action.tool}`: {action.tool_input}")
+
+        def on_tool_end(self, output, **kwargs):
+            job.check_cancelled()
+            job.add_step(f"Result: {str(output)[:500]}")
+
+    return StreamingCallbackHandler()
+
+
+# Function to run handler(instruction, *args, callbacks=...) in a background thread
+def start_query(handler, instruction, *args):
+    job = QueryJob(instruction)
+
+    def run():
+        _current_job.set(job)
+        try:
+            job.result = handler(instruction, *args, callbacks=[make_callback_handler(job)])
+        except QueryCancelled:
+            job.result = "Query cancelled."
+        except Exception as e:
+            job.result = f"Error handling instruction: {e}"
+        # The handler reports errors as text, a cancel may still surface as one of them (e.g. wrapped by
+        # a library), the error notices it left are dropped with it
+        if job.cancelled() and isinstance(job.result, str) and job.result.startswith(("Error handling instruction", "Query cancelled")):
+            job.result = "Query cancelled."
+            with job.lock:
+                job.notices = [notice for notice in job.notices if notice[0] != "error"]
+        job.done_event.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    return job
@@ -0,0 +1,82 @@
+import io
+import os
+import re
+from jinja2 import Environment
+from dotenv import load_dotenv
+from utils import tracing
+
+load_dotenv()
+
+# Rows shown per anomaly section in the email body, the rest goes to the attachment
+REPORT_MAX_ROWS = int(os.getenv("REPORT_MAX_ROWS", "20"))
+# Format of the full result attachments: "csv" (gzip compressed) or "parquet"
+REPORT_ATTACHMENT_FORMAT = os.getenv("REPORT_ATTACHMENT_FORMAT", "csv")
+
+REPORT_TEMPLATE = """<html><body><h1>Anomaly Report</h1><br><p>We compiled a list of anomalies found, take a look at the data below</p>
+{% for file in files %}<h2>{{ file.title }}</h2>
+{% for section in file.sections %}<h3>{{ section.title }}</h3>
+{% if section.count == 0 %}<p>No anomalies detected.</p>
+{% else %}<p>{{ section.count }} row(s) found{% if section.count > section.shown %}, showing the first {{ section.shown }}{% endif %}.{% if section.attachment %} Full results attached as {{ section.attachment }}.{% endif %}</p>
+{{ section.table | safe }}
+{% endif %}{% endfor %}{% endfor %}</body></html>
+"""
+
+# The template is compiled once and reused by every report
+_template = Environment(autoescape=True).from_string(REPORT_TEMPLATE)
+
+
+# Function to turn an anomaly group title into a safe file name
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+
+# Function to write the full anomaly frame as a compressed attachment
+@tracing.traced("write_attachment")
+def write_attachment(df, folder_path, name):
+    os.makedirs(folder_path, exist_ok=True)
+    if REPORT_ATTACHMENT_FORMAT == "parquet":
+        path = f"{folder_path}/{name}.parquet"
+        # Object columns can mix types after read_csv, parquet needs them consistent
+        df.astype({col: str for col in df.select_dtypes("object").columns}).to_parquet(
+            path, index=False, compression="zstd"
+        )
+    else:
+        path = f"{folder_path}/{name}.csv.gz"
+        df.to_csv(path, index=False, compression="gzip")
+    tracing.annotate(rows=len(df), bytes=os.path.getsize(path))
+    return path
+
+
+# Function to build the capped sections of one file, writing attachments for the full results
+def build_sections(file_title, anomalies, attachment_folder=None, max_rows=REPORT_MAX_ROWS):
+    sections = []
+    attachments = []
+    for key, df in anomalies.items():
+        section = {"title": key, "count": len(df), "shown": min(len(df), max_rows), "table": "", "attachment": None}
+        if not df.empty:
+            section["table"] = df.head(max_rows).to_html(index=False)
+            if attachment_folder is not None and len(df) > max_rows:
+                path = write_attachment(df, attachment_folder, slugify(f"{file_title} {key}"))
+                section["attachment"] = os.path.basename(path)
+                attachments.append(path)
+        sections.append(section)
+    return {"title": file_title, "sections": sections}, attachments
+
+
+# Function to stream the rendered report into a file-like object
+def render_report(files, output):
+    _template.stream(files=files).dump(output)
+
+
+# Function to build the full report, returns the HTML and the attachment paths
+def build_report(anomalies_by_file, attachment_folder=None, max_rows=REPORT_MAX_ROWS):
+    files = []
+    attachments = []
+    for file_title, anomalies in anomalies_by_file.items():
+        file_sections, file_attachments = build_sections(file_title, anomalies, attachment_folder, max_rows)
+        files.append(file_sections)
+        attachments.extend(file_attachments)
+
+    output = io.StringIO()
+    render_report(files, output)
+    return output.getvalue(), attachments
@@ -0,0 +1,55 @@
+import pandas as pd
+
+# Columns never shown in a result, searchable_text repeats every value of its row
+HIDDEN_COLUMNS = ["searchable_text"]
+
+
+# A lazy result: the ids of the affected rows and a projection of the source frame,
+# rows are only copied out of the frame one page at a time
+class ResultView:
+    def __init__(self, df, row_ids, columns=None, prune=True):
+        self.df = df
+        self.row_ids = pd.Index(row_ids)
+        self.prune = prune
+        self._columns = list(columns) if columns is not None else None
+
+    def __len__(self):
+        return len(self.valid_ids())
+
+    # Ids still present in the frame, rows may have been deleted since the view was made
+    def valid_ids(self):
+        return self.row_ids[self.row_ids.isin(self.df.index)]
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = self.project()
+        return self._columns
+
+    # Function to pick the columns to show, dropping the ones that are empty for every
+    # source_table of the rows, i.e. the columns of the other tables in combined_data
+    def project(self):
+        columns = [col for col in self.df.columns if col not in HIDDEN_COLUMNS]
+        row_ids = self.valid_ids()
+        if not self.prune or len(row_ids) == 0:
+            return columns
+
+        rows = self.df.loc[row_ids]
+        if "source_table" in rows.columns and rows["source_table"].notna().any():
+            tables = rows["source_table"].dropna().unique()
+            filled = self.df.loc[self.df["source_table"].isin(tables), columns].notna().any()
+        else:
+            filled = rows[columns].notna().any()
+        return [col for col in columns if filled[col]]
+
+    def page(self, page=0, page_size=100):
+        row_ids = self.valid_ids()[page * page_size:(page + 1) * page_size]
+        return self.df.loc[row_ids, self.columns]
+
+    def to_frame(self):
+        return self.df.loc[self.valid_ids(), self.columns]
+
+    # Memory held by the view itself, the frame it points to is owned by the session
+    # (FrameStore.detach_views copies the rows out once the session moves to another frame)
+    def memory_usage(self):
+        return int(self.row_ids.nbytes)
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Number of finished requests kept for the debug panel
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "20"))
+# Optional exporters: every finished request appended as a JSON line, and the
+# metrics rewritten in the Prometheus text format (node_exporter textfile style)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+TRACE_METRICS_PATH = os.getenv("TRACE_METRICS_PATH")
+# Optional port serving the metrics on /metrics
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_recent = deque(maxlen=TRACE_HISTORY)
+_metrics = {}
+_server = None
+
+
+# A timed operation, spans opened inside it become its children
+class Span:
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.children = []
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, **attrs):
+        if self.duration is not None:
+            return
+        self.attrs.update(attrs)
+        self.duration = time.perf_counter() - self.start
+        record_metrics(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": (self.duration or 0) * 1000,
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+# Context manager timing a block, the outermost span of a thread is a request and is kept for the debug panel
+@contextmanager
+def span(name, **attrs):
+    parent = _current_span.get()
+    current = Span(name, parent, **attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+        close(current)
+        if parent is None:
+            finish_request(current)
+
+
+# Decorator timing every call of a function in a span
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Function to start a span without a with block, for code with several exits; it ends with its request
+def start_span(name, **attrs):
+    return Span(name, _current_span.get(), **attrs)
+
+
+# Function to set attributes on the innermost open span, if any
+def annotate(**attrs):
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+# Function to end a span and the children left open, e.g. by an early return
+def close(current):
+    for child in current.children:
+        close(child)
+    current.end()
+
+
+# Function to write a DataFrame to CSV inside a span recording its rows and bytes
+def write_csv(df, path, name="write_csv", **to_csv_kwargs):
+    with span(name, rows=len(df)) as current:
+        df.to_csv(path, **to_csv_kwargs)
+        current.set(bytes=os.path.getsize(path))
+
+
+def record_metrics(current):
+    with _lock:
+        metric = _metrics.setdefault(current.name, {"count": 0, "seconds": 0.0, "rows": 0, "bytes": 0})
+        metric["count"] += 1
+        metric["seconds"] += current.duration
+        for key in ("rows", "bytes"):
+            if isinstance(current.attrs.get(key), (int, float)):
+                metric[key] += current.attrs[key]
+
+
+def finish_request(request):
+    with _lock:
+        _recent.append(request)
+    if TRACE_EXPORT_PATH:
+        with open(TRACE_EXPORT_PATH, "a") as file:
+            file.write(json.dumps(request.to_dict(), default=str) + "\n")
+    if TRACE_METRICS_PATH:
+        temp_path = f"{TRACE_METRICS_PATH}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(prometheus_text())
+        os.replace(temp_path, TRACE_METRICS_PATH)
+
+
+# Function to return the last finished requests, most recent first
+def recent_requests(limit=TRACE_HISTORY):
+    with _lock:
+        return list(_recent)[::-1][:limit]
+
+
+# Function to flatten a request into one row per span, children indented under their parent
+def breakdown(request):
+    rows = []
+
+    def visit(current, depth):
+        rows.append({
+            "span": "  " * depth + current.name,
+            "ms": round((current.duration or 0) * 1000, 1),
+            "rows": current.attrs.get("rows"),
+            "bytes": current.attrs.get("bytes"),
+        })
+        for child in current.children:
+            visit(child, depth + 1)
+
+    visit(request, 0)
+    return rows
+
+
+# Function to render the metrics in the Prometheus text exposition format
+def prometheus_text():
+    lines = [
+        "# HELP sheetbot_span_seconds Time spent in each span.",
+        "# TYPE sheetbot_span_seconds summary",
+    ]
+    with _lock:
+        metrics = {name: dict(metric) for name, metric in _metrics.items()}
+    for name, metric in sorted(metrics.items()):
+        lines.append(f'sheetbot_span_seconds_sum{{span="{name}"}} {metric["seconds"]:.6f}')
+        lines.append(f'sheetbot_span_seconds_count{{span="{name}"}} {metric["count"]}')
+    for key, help_text in (("rows", "Rows processed by each span."), ("bytes", "Bytes written by each span.")):
+        lines.append(f"# HELP sheetbot_span_{key}_total {help_text}")
+        lines.append(f"# TYPE sheetbot_span_{key}_total counter")
+        for name, metric in sorted(metrics.items()):
+            lines.append(f'sheetbot_span_{key}_total{{span="{name}"}} {metric[key]}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to serve /metrics on METRICS_PORT in a background thread, does nothing when it is not set
+def start_metrics_server(port=METRICS_PORT):
+    global _server
+    if not port or _server is not None:
+        return _server
+    _server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"Metrics served on port {port}")
+    return _server